@@ -1,32 +1,34 @@
 from config import Config
-from app.database import db
+from app.database import db, init_db
 from flask import Flask
-from app.blueprints import user_routes, post_routes, static_routes
+from app.blueprints import user_routes, post_routes, static_routes, metrics_routes, feed_routes, api_routes
 from flask_bootstrap import Bootstrap5
-from app.models import User
 from app.database import db
 from flask_gravatar import Gravatar
 from flask_login import LoginManager
 from flask_ckeditor import CKEditor
-from app.utilities import setup_logger
+from app.utilities import setup_logger, init_request_ids, init_json, metrics
+from app.services import (assets, authentication, identity_cache, page_cache, post_deletion, rendering, search,
+                          syndication, view_counter)
+from app.commands import register_commands
 
 
 def create_app(config_class=Config):
     app = Flask(__name__, template_folder='templates')
     app.config.from_object(config_class)
+    init_json(app)
     Bootstrap5(app)
-    db.init_app(app)
-    with app.app_context():
-        db.create_all()
+    init_db(app)
+    if app.config["DB_CREATE_ALL"]:
+        with app.app_context():
+            db.create_all()
 
     ckeditor = CKEditor(app)
 
+    identity_cache.init_app(app)
     login_manager = LoginManager()
     login_manager.init_app(app)
-
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
+    login_manager.user_loader(identity_cache.load_user)
 
     gravatar = Gravatar(app,
                         size=100,  # Adjusted size
@@ -37,9 +39,30 @@ def create_app(config_class=Config):
                         use_ssl=False,
                         base_url=None)
 
+    authentication.init_app(app)
+
+    @app.errorhandler(authentication.HashingOverloaded)
+    def hashing_overloaded(error):
+        return "Too many sign-in attempts at the moment, please retry shortly.", 503, {"Retry-After": "1"}
+
+    page_cache.init_app(app)
+    rendering.init_app(app)
+    assets.init_app(app)
+    search.init_app(app)
+    syndication.init_app(app)
+    post_deletion.init_app(app)
+    view_counter.init_app(app)
+    register_commands(app)
+
     app.register_blueprint(user_routes)
     app.register_blueprint(post_routes)
     app.register_blueprint(static_routes)
-    setup_logger()
+    app.register_blueprint(metrics_routes)
+    app.register_blueprint(feed_routes)
+    app.register_blueprint(api_routes)
+    metrics.init_app(app)
+    init_request_ids(app)
+    setup_logger(level=app.config["LOG_LEVEL"], log_format=app.config["LOG_FORMAT"],
+                 sampling=app.config["LOG_SAMPLING"], queue_size=app.config["LOG_QUEUE_SIZE"])
 
     return app
@@ -1,3 +1,6 @@
 from .user_routes import user_routes
 from .post_routes import post_routes
 from .static_routes import static_routes
+from .metrics_routes import metrics_routes
+from .feed_routes import feed_routes
+from .api_routes import api_routes
@@ -0,0 +1,83 @@
+from datetime import datetime
+from flask import Blueprint, current_app, jsonify, request
+from app.database import db, crud_post
+import logging
+logger = logging.getLogger(__name__)
+api_routes = Blueprint("api_routes", __name__, url_prefix="/api/v1")
+
+# Returned when the request names no fields. The id is always returned.
+DEFAULT_LIST_FIELDS = ["title", "subtitle", "date", "author", "excerpt", "created_at", "comment_count"]
+DEFAULT_POST_FIELDS = [*DEFAULT_LIST_FIELDS, "img_url", "body_html", "updated_at"]
+
+
+class ApiError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+@api_routes.errorhandler(ApiError)
+def api_error(error):
+    return jsonify(error=str(error)), error.status
+
+
+def _requested_fields(default):
+    value = request.args.get("fields")
+    if not value:
+        return default
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in crud_post.POST_FIELDS]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}. Known fields: {', '.join(crud_post.POST_FIELDS)}.")
+    return fields
+
+
+def _requested_ids():
+    value = request.args.get("ids")
+    if value is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(post_id) for post_id in value.split(",") if post_id.strip()))
+    except ValueError:
+        raise ApiError("ids must be a comma-separated list of post ids.")
+    if len(ids) > current_app.config["API_MAX_PAGE_SIZE"]:
+        raise ApiError(f"At most {current_app.config['API_MAX_PAGE_SIZE']} ids can be requested at once.")
+    return ids
+
+
+def _record(row):
+    return {field: value.isoformat() if isinstance(value, datetime) else value for field, value in row.items()}
+
+
+def _conditional(response):
+    # The ETag is a hash of the body, so a client holding the current copy gets a 304 without it.
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@api_routes.route("/posts")
+def list_posts():
+    # Newest first, keyset paginated with before=<next_cursor>, or the posts of ids=1,2,3 in that order.
+    fields = _requested_fields(DEFAULT_LIST_FIELDS)
+    ids = _requested_ids()
+    if ids is not None:
+        rows = {row["id"]: row for row in crud_post.get_post_fields(db=db, fields=fields, ids=ids)}
+        return _conditional(jsonify(posts=[_record(rows[post_id]) for post_id in ids if post_id in rows]))
+
+    limit = min(request.args.get("limit", current_app.config["POSTS_PER_PAGE"], type=int),
+                current_app.config["API_MAX_PAGE_SIZE"])
+    if limit < 1:
+        raise ApiError("limit must be at least 1.")
+    # Fetch one extra row to know whether there is a page beyond this one.
+    rows = crud_post.get_post_fields(db=db, fields=fields, before=request.args.get("before", type=int),
+                                     limit=limit + 1)
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return _conditional(jsonify(posts=[_record(row) for row in rows[:limit]], next_cursor=next_cursor))
+
+
+@api_routes.route("/posts/<int:post_id>")
+def get_post(post_id):
+    rows = crud_post.get_post_fields(db=db, fields=_requested_fields(DEFAULT_POST_FIELDS), ids=[post_id])
+    if not rows:
+        raise ApiError(f"There is no post with id {post_id}.", status=404)
+    return _conditional(jsonify(_record(rows[0])))
@@ -0,0 +1,28 @@
+from flask import Blueprint, abort, send_file
+from app.services import syndication
+import logging
+logger = logging.getLogger(__name__)
+feed_routes = Blueprint("feed_routes", __name__)
+
+
+# send_file answers If-None-Match and If-Modified-Since from the file itself, so most polls
+# get a 304 without a query.
+
+@feed_routes.route("/feed.xml")
+def feed():
+    path = syndication.get_syndication_store().feed_path()
+    return send_file(path, mimetype="application/rss+xml", conditional=True)
+
+
+@feed_routes.route("/sitemap.xml")
+def sitemap():
+    path = syndication.get_syndication_store().sitemap_path()
+    return send_file(path, mimetype="application/xml", conditional=True)
+
+
+@feed_routes.route("/sitemap-<int:shard>.xml")
+def sitemap_shard(shard):
+    path = syndication.get_syndication_store().shard_path(shard)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype="application/xml", conditional=True)
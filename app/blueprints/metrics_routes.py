@@ -0,0 +1,35 @@
+import hmac
+from flask import Blueprint, Response, abort, current_app, request
+from app.utilities import metrics
+from app.utilities.logger import DroppingQueueHandler
+metrics_routes = Blueprint("metrics_routes", __name__)
+
+
+def _is_authorized() -> bool:
+    # A scraper either sends the bearer token of METRICS_TOKEN or connects from METRICS_ALLOWED_IPS.
+    token = current_app.config["METRICS_TOKEN"]
+    authorization = request.headers.get("Authorization", "")
+    if token and hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+        return True
+    return request.remote_addr in current_app.config["METRICS_ALLOWED_IPS"]
+
+
+@metrics_routes.route("/metrics")
+def export_metrics():
+    registry = metrics.get_metrics_registry()
+    if registry is None:
+        return abort(404)
+    if not _is_authorized():
+        return abort(403)
+
+    extra = {"log_records_dropped_total": ("counter", "Log records dropped because the log queue was full.",
+                                           DroppingQueueHandler.dropped)}
+    for name, description in (("page_cache", "rendered-page cache"), ("identity_cache", "identity cache")):
+        cache = current_app.extensions.get(name)
+        if cache is not None:
+            stats = cache.stats()
+            extra[f"{name}_hits_total"] = ("counter", f"Hits of the {description} in this process.", stats["hits"])
+            extra[f"{name}_misses_total"] = ("counter", f"Misses of the {description} in this process.",
+                                             stats["misses"])
+            extra[f"{name}_entries"] = ("gauge", f"Entries in the {description}.", stats["entries"])
+    return Response(registry.render(extra), mimetype="text/plain; version=0.0.4")
@@ -1,48 +1,165 @@
-from flask import Blueprint, render_template, redirect, url_for, abort, flash
+from flask import Blueprint, render_template, redirect, url_for, abort, flash, request, current_app, jsonify
 from app.forms import CreatePostForm, CommentForm, UpdatePostForm
 from app.database import db, crud_post, crud_comment
+from app.utilities.streaming import render_page
+from app.services import rendering
+from app.services.page_cache import cached_page, conditional_page, add_tags, comments_key, index_key, post_key
+from app.services.view_counter import counts_views
 from flask_login import current_user
+from datetime import datetime
 from functools import wraps
 import logging
+logger = logging.getLogger(__name__)
 post_routes = Blueprint('post_routes', __name__)
 
 
 def admin_only(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if not current_user.is_admin:
+        if not current_user.is_authenticated or not current_user.is_admin:
             return abort(403)
         return f(*args, **kwargs)
 
     return decorated_function
 
 
+def _parse_activity_cursor(cursor):
+    # "<last_activity_at ISO 8601>_<post id>", as built by _format_activity_cursor.
+    try:
+        last_activity_at, post_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(last_activity_at), int(post_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _format_activity_cursor(cursor):
+    return f"{cursor[0].isoformat()}_{cursor[1]}" if cursor else None
+
+
 @post_routes.route('/')
+@cached_page(index_key)
 def get_all_posts():
-    posts = crud_post.get_all_posts(db=db)
-    return render_template("index.html", all_posts=posts, current_user=current_user)
+    if request.args.get("sort") == "activity":
+        page = crud_post.get_active_posts_page(
+            db=db,
+            before=_parse_activity_cursor(request.args.get("cursor")),
+            page_size=current_app.config["POSTS_PER_PAGE"]
+        )
+        add_tags("index:activity", *(f"listing:{post.id}" for post in page.posts))
+        return render_page("index.html", all_posts=page.posts, sort="activity",
+                           older_cursor=_format_activity_cursor(page.older_cursor),
+                           is_first_page=not request.args.get("cursor"), current_user=current_user)
+
+    if request.args.get("sort") == "views":
+        posts = crud_post.get_most_viewed_posts(db=db, limit=current_app.config["POSTS_PER_PAGE"])
+        add_tags("index:views", *(f"listing:{post.id}" for post in posts))
+        return render_page("index.html", all_posts=posts, sort="views", current_user=current_user)
+
+    after = request.args.get("after", type=int)
+    page = crud_post.get_posts_page(
+        db=db,
+        before=request.args.get("before", type=int),
+        after=after,
+        page_size=current_app.config["POSTS_PER_PAGE"]
+    )
+    add_tags(*(f"listing:{post.id}" for post in page.posts))
+    if after is not None or page.newer_cursor is None:
+        # A new post would show up on this page.
+        add_tags("index:head")
+    return render_page("index.html", all_posts=page.posts, sort="newest", older_cursor=page.older_cursor,
+                       newer_cursor=page.newer_cursor, current_user=current_user)
+
+
+@post_routes.route('/search')
+def search_posts():
+    query = request.args.get("q", "").strip()
+    page_number = max(request.args.get("page", 1, type=int), 1)
+    page_size = current_app.config["POSTS_PER_PAGE"]
+    results = []
+    if query:
+        # Fetch one extra result to know whether there is a next page.
+        results = crud_post.search_posts(db=db, query=query, limit=page_size + 1,
+                                         offset=(page_number - 1) * page_size)
+    return render_template("search.html", query=query, results=results[:page_size], page_number=page_number,
+                           has_next=len(results) > page_size, current_user=current_user)
+
+
+def post_last_modified(post_id, **kwargs):
+    return crud_post.get_post_last_modified(db=db, post_id=post_id)
+
+
+def post_tags(post_id, **kwargs):
+    return [f"post:{post_id}"]
 
 
 @post_routes.route("/post/<int:post_id>", methods=["GET", "POST"])
+@counts_views(lambda post_id, **kwargs: post_id)
+@conditional_page(post_last_modified, make_key=post_key, make_tags=post_tags)
+@cached_page(post_key)
 def show_post(post_id):
-    requested_post = crud_post.get_post_by_id(db=db, post_id=post_id)
+    # Anonymous visitors may be served a cached page, so do not rely on its form token.
+    if request.method == "POST" and not current_user.is_authenticated:
+        return redirect(url_for("user_routes.login"))
+
+    requested_post = crud_post.get_post_with_author(db=db, post_id=post_id)
+    if not requested_post:
+        return abort(404)
+    add_tags(f"post:{post_id}")
     comment_form = CommentForm()
     try:
         if comment_form.validate_on_submit():
-            if not current_user.is_authenticated:
-                return redirect(url_for("user_routes.login"))
 
-            result = crud_comment.get_comment_by_text(db=db, comment_form=comment_form)
-            if not result:
-                crud_comment.create_comment(db=db, comment_form=comment_form, requested_post=requested_post)
-                comment_form.comment_text.data = ""
-            elif result.comment_author != current_user:
-                crud_comment.create_comment(db=db, comment_form=comment_form, requested_post=requested_post)
+            new_comment = crud_comment.create_comment(db=db, comment_form=comment_form, requested_post=requested_post)
+            if new_comment:
                 comment_form.comment_text.data = ""
+            else:
+                # The rollback expired the post, reload it.
+                requested_post = crud_post.get_post_with_author(db=db, post_id=post_id)
 
     except Exception as e:
-        logging.error(f"Showing post error for post_id: {post_id}, error: {e}")
-    return render_template("post.html", post=requested_post, current_user=current_user, form=comment_form)
+        logger.error("Showing post error for post_id: %s, error: %s", post_id, e)
+    # Only the first page of comments is rendered, read while the page renders (and, streamed, while
+    # it is sent); the page fetches the rest from get_post_comments. The extra row tells whether
+    # there are more.
+    comments_page_size = current_app.config["COMMENTS_PER_PAGE"]
+    comments = crud_comment.iter_post_comments(db=db, post_id=post_id,
+                                               batch_size=current_app.config["STREAM_COMMENTS_BATCH_SIZE"],
+                                               limit=comments_page_size + 1)
+    return render_page("post.html", post=requested_post, comments=comments, comments_page_size=comments_page_size,
+                       current_user=current_user, form=comment_form)
+
+
+@post_routes.route("/post/<int:post_id>/comments")
+@cached_page(comments_key, mimetype="application/json")
+def get_post_comments(post_id):
+    # One page of comments, oldest first or, with order=newest, newest first. after is the
+    # next_cursor of the previous page.
+    order = "newest" if request.args.get("order") == "newest" else "oldest"
+    after = request.args.get("after", type=int)
+    page = crud_comment.get_comments_page(db=db, post_id=post_id, newest_first=order == "newest", after=after,
+                                          page_size=current_app.config["COMMENTS_PER_PAGE"])
+    if not page.comments and after is None and crud_post.get_post_last_modified(db=db, post_id=post_id) is None:
+        return abort(404)
+    add_tags(f"post:{post_id}")
+
+    gravatar = current_app.jinja_env.filters["gravatar"]
+    avatars = {}
+    records = []
+    for comment in page.comments:
+        author = comment.comment_author
+        if author.id not in avatars:
+            avatars[author.id] = gravatar(author.email)
+        records.append({
+            "id": comment.id,
+            "author": author.name,
+            "avatar": avatars[author.id],
+            "html": comment.text_html if comment.text_html is not None else rendering.compile_comment(comment.text),
+            "created_at": comment.created_at.isoformat(),
+        })
+    next_url = None
+    if page.next_cursor is not None:
+        next_url = url_for("post_routes.get_post_comments", post_id=post_id, order=order, after=page.next_cursor)
+    return jsonify(comments=records, next_cursor=page.next_cursor, next_url=next_url)
 
 
 @post_routes.route("/new-post", methods=["GET", "POST"])
@@ -51,20 +168,17 @@ def add_new_post():
     form = CreatePostForm()
     try:
         if form.validate_on_submit():
-            post_title = form.title.data
-            is_post_exists = crud_post.get_post_by_title(db=db, title=post_title)
-            if not is_post_exists:
-                new_post = crud_post.create_new_post(db=db, create_post_form=form)
-                logging.info(f"New post {form.title.data} created by {current_user.email}")
+            new_post = crud_post.create_new_post(db=db, create_post_form=form)
+            if new_post:
+                logger.info("New post %s created by %s", form.title.data, current_user.email)
                 return redirect(url_for("post_routes.show_post", post_id=new_post.id))
             else:
                 flash("There is already a post with that title", 'error')
-                logging.warning(f"Post title {form.title.data} already exists.")
                 form.title.data = ""
                 # Instead of redirecting, re-render the same page with the form containing the existing data
                 return render_template("make-post.html", form=form, type='create')
     except Exception as e:
-        logging.error(f"Post creation failed: {e}")
+        logger.error("Post creation failed: %s", e)
 
     return render_template("make-post.html", form=form, type='create')
 
@@ -76,7 +190,6 @@ def edit_post(post_id):
     post_to_edit_form = UpdatePostForm(
         title=blog_post.title,
         subtitle=blog_post.subtitle,
-        author=blog_post.author,
         img_url=blog_post.img_url,
         body=blog_post.body
     )
@@ -84,10 +197,11 @@ def edit_post(post_id):
         if post_to_edit_form.validate_on_submit():
             updated_blog_post = crud_post.update_post(db=db, update_form=post_to_edit_form, post_to_update=blog_post)
             if updated_blog_post:
-                return redirect(url_for("post_routes.show_post", post_id=blog_post.id))
+                return redirect(url_for("post_routes.show_post", post_id=post_id))
+            flash("There is already a post with that title", 'error')
 
     except Exception as e:
-        logging.error(f"Post update failed: {e}")
+        logger.error("Post update failed: %s", e)
     return render_template("make-post.html", form=post_to_edit_form, type='edit')
 
 
@@ -97,5 +211,5 @@ def delete_post(post_id):
     try:
         crud_post.delete_post(db=db, post_id=post_id)
     except Exception as e:
-        logging.error(f"Post deletion failed: {e}")
+        logger.error("Post deletion failed: %s", e)
     return redirect(url_for("post_routes.get_all_posts"))
@@ -5,6 +5,7 @@ from app.database import crud_user
 from app.services import authentication
 from flask_login import login_user, current_user, logout_user
 import logging
+logger = logging.getLogger(__name__)
 # Blueprint definition
 user_routes = Blueprint('user_routes', __name__)
 
@@ -18,20 +19,28 @@ def login():
             password = login_form.password.data
             if not user:
                 flash("User does not exist")
-                logging.warning("Failed login attempt - User does not exist.")
+                logger.warning("Failed login attempt - User does not exist.")
                 return redirect(url_for("user_routes.login"))
 
             elif not authentication.confirm_password(user.password, password):
                 flash("email or password is wrong")
-                logging.warning("Failed login attempt - email or password wrong.")
+                logger.warning("Failed login attempt - email or password wrong.")
                 return redirect(url_for("user_routes.login"))
 
-            logging.info(f"User {user.email} logged in successfully.")
+            if authentication.password_needs_rehash(user.password):
+                try:
+                    crud_user.update_user_password(db=db, user=user, password=password)
+                except authentication.HashingOverloaded:
+                    logger.info("Skipped password rehash, hashing is overloaded.")
+
+            logger.info("User %s logged in successfully.", user.email)
             login_user(user)
             return redirect(url_for("post_routes.get_all_posts"))
 
+    except authentication.HashingOverloaded:
+        raise
     except Exception as e:
-        logging.error(f"Login error: {e}")
+        logger.error("Login error: %s", e)
         flash("An unexpected error occurred while logging in.", "error")
     return render_template("login.html", form=login_form, current_user=current_user)
 
@@ -41,20 +50,18 @@ def register():
     register_form = RegisterUserForm()
     try:
         if register_form.validate_on_submit():
-            user = crud_user.get_user_by_mail(db=db, email=register_form.email.data)
-            if user:
+            user_to_register = crud_user.create_user(db=db, register_form=register_form)
+            if not user_to_register:
                 flash("user already exists, please try to login")
-                logging.info(f"User {user.email} already exists.")
                 return redirect(url_for('user_routes.login'))
 
-            user_to_register = crud_user.create_user(db=db, register_form=register_form)
-            if user_to_register:
-                login_user(user_to_register)
-                logging.warning("Registration failed.")
-                return redirect(url_for("post_routes.get_all_posts"))
+            login_user(user_to_register)
+            return redirect(url_for("post_routes.get_all_posts"))
 
+    except authentication.HashingOverloaded:
+        raise
     except Exception as e:
-        logging.error(f"Registration error: {e}")
+        logger.error("Registration error: %s", e)
         flash("An unexpected error occurred during registration.", "error")
     return render_template("register.html", form=register_form, current_user=current_user)
 
@@ -63,8 +70,8 @@ def register():
 def logout():
     try:
         logout_user()
-        logging.info(f"User {current_user.email} logged out.")
+        logger.info("User %s logged out.", current_user.email)
     except Exception as e:
-        logging.error(f"Logout error: {e}")
+        logger.error("Logout error: %s", e)
         flash("An unexpected error occurred during registration.", "error")
     return redirect(url_for("post_routes.get_all_posts"))
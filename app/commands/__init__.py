@@ -0,0 +1,14 @@
+from flask import Flask
+from .database import db_cli
+from .search import search_cli
+from .content import content_cli
+from .stats import stats_cli
+from .assets import assets_cli
+
+
+def register_commands(app: Flask):
+    app.cli.add_command(db_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(content_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(assets_cli)
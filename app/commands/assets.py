@@ -0,0 +1,16 @@
+import os
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from app.services import assets
+
+assets_cli = AppGroup("assets", help="Build the fingerprinted, precompressed static files.")
+
+
+@assets_cli.command("build")
+def build():
+    """Fingerprint and compress the static files and write their manifest. Restart the app to pick it up."""
+    build_dir = os.path.join(current_app.static_folder, current_app.config["ASSETS_BUILD_DIR"])
+    manifest = assets.build(current_app.static_folder, build_dir)
+    compressed = sum(bool(encodings) for encodings in manifest["encodings"].values())
+    click.echo(f"Built {len(manifest['files'])} static files into {build_dir}, {compressed} with compressed variants.")
@@ -0,0 +1,114 @@
+import csv
+import json
+import click
+from flask.cli import AppGroup
+from app.database import db
+from app.models import BlogPost
+from app.services import content, page_cache, post_deletion, rendering, syndication
+
+content_cli = AppGroup("content", help="Import and export users, posts and comments as JSONL or CSV, compile their "
+                                        "HTML and delete them in bulk.")
+
+KINDS = click.Choice(list(content.FIELDS))
+FORMATS = click.Choice(["jsonl", "csv"])
+
+
+def _format_of(file, file_format):
+    if file_format:
+        return file_format
+    return "csv" if file.name.endswith(".csv") else "jsonl"
+
+
+@content_cli.command("export")
+@click.argument("kind", type=KINDS)
+@click.argument("output", type=click.File("w", encoding="utf-8", lazy=True), default="-")
+@click.option("--format", "file_format", type=FORMATS, help="Defaults to csv for .csv files, jsonl otherwise.")
+@click.option("--batch-size", default=1000, show_default=True, help="Number of rows fetched per round trip.")
+def export(kind, output, file_format, batch_size):
+    """Write every user, post or comment to OUTPUT (stdout by default)."""
+    if _format_of(output, file_format) == "csv":
+        writer = csv.DictWriter(output, fieldnames=content.FIELDS[kind])
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(record):
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    exported = 0
+    for exported, record in enumerate(content.export_records(db.session, kind, batch_size=batch_size), start=1):
+        write(record)
+        if exported % 100_000 == 0:
+            click.echo(f"Exported {exported} {kind}...", err=True)
+    click.echo(f"Exported {exported} {kind}.", err=True)
+
+
+@content_cli.command("import")
+@click.argument("kind", type=KINDS)
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("--format", "file_format", type=FORMATS, help="Defaults to csv for .csv files, jsonl otherwise.")
+@click.option("--batch-size", default=1000, show_default=True, help="Number of rows inserted per statement.")
+@click.option("--on-duplicate", type=click.Choice(["skip", "merge"]), default="skip", show_default=True,
+              help="What to do with users whose email or posts whose title already exist.")
+def import_(kind, source, file_format, batch_size, on_duplicate):
+    """Read users, posts or comments from SOURCE (stdin by default). Import users before posts and comments."""
+    if _format_of(source, file_format) == "csv":
+        records = csv.DictReader(source)
+    else:
+        records = (json.loads(line) for line in source if line.strip())
+
+    progress = None
+    try:
+        for progress in content.import_records(db.session, kind, records, batch_size=batch_size,
+                                               on_duplicate=on_duplicate):
+            click.echo(f"Read {progress.read} {kind}: {progress.inserted} inserted, "
+                       f"{progress.updated} updated, {progress.skipped} skipped...")
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        page_cache.invalidate_all()
+        syndication.invalidate_all()
+    if progress is None:
+        click.echo(f"No {kind} to import.")
+    else:
+        click.echo(f"Imported {kind}: {progress.inserted} inserted, {progress.updated} updated, "
+                   f"{progress.skipped} skipped.")
+
+
+@content_cli.command("compile")
+@click.option("--batch-size", default=500, show_default=True, help="Number of rows compiled per statement.")
+@click.option("--all", "recompile_all", is_flag=True,
+              help="Recompile every row, e.g. after a change to the pipeline, not only rows never compiled.")
+def compile_(batch_size, recompile_all):
+    """Compile the render-ready HTML and excerpts of posts and comments saved without them."""
+    for kind, compile_rows in (("posts", rendering.compile_posts), ("comments", rendering.compile_comments)):
+        compiled = 0
+        for compiled in compile_rows(db.session, batch_size=batch_size, recompile_all=recompile_all):
+            click.echo(f"Compiled {compiled} {kind}...")
+        click.echo(f"Compiled {compiled} {kind}.")
+    page_cache.invalidate_all()
+
+
+@content_cli.command("delete-post")
+@click.argument("post_id", type=int)
+@click.option("--batch-size", default=1000, show_default=True, help="Number of comments deleted per transaction.")
+def delete_post(post_id, batch_size):
+    """Delete the post POST_ID and its comments, however many there are. Safe to rerun if interrupted."""
+    if db.session.get(BlogPost, post_id) is None:
+        raise click.ClickException(f"There is no post with id {post_id}.")
+    deleted = 0
+    # Reports the progress of the batches; post_deletion.delete_post then finds them gone.
+    for progress in post_deletion.delete_comments(db.session, post_id, batch_size=batch_size):
+        deleted = progress.deleted
+        click.echo(f"Deleted {deleted} comments...")
+    deleted += post_deletion.delete_post(db.session, post_id, batch_size=batch_size)
+    click.echo(f"Deleted post {post_id} and {deleted} comments.")
+
+
+@content_cli.command("purge-orphans")
+@click.option("--batch-size", default=1000, show_default=True, help="Number of comments deleted per transaction.")
+def purge_orphans(batch_size):
+    """Delete the comments whose post no longer exists."""
+    progress = None
+    for progress in post_deletion.purge_orphan_comments(db.session, batch_size=batch_size):
+        click.echo(f"Deleted {progress.deleted} orphaned comments...")
+    click.echo(f"Deleted {progress.deleted if progress else 0} orphaned comments.")
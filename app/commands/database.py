@@ -0,0 +1,24 @@
+import click
+from flask.cli import AppGroup
+from app.database import db, migrations
+
+db_cli = AppGroup("db", help="Manage the database schema.")
+
+
+@db_cli.command("init")
+def init():
+    """Create the missing tables and record the migrations they include as applied."""
+    db.create_all()
+    with db.engine.begin() as connection:
+        migrations.upgrade(connection)
+    click.echo("Database is initialised.")
+
+
+@db_cli.command("upgrade")
+def upgrade():
+    """Apply the pending schema migrations."""
+    with db.engine.begin() as connection:
+        applied = migrations.upgrade(connection)
+    for name in applied:
+        click.echo(f"Applied {name}.")
+    click.echo("Database is up to date.")
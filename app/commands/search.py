@@ -0,0 +1,17 @@
+import click
+from flask.cli import AppGroup
+from app.database import db
+from app.services import search
+
+search_cli = AppGroup("search", help="Manage the full-text search index of the posts.")
+
+
+@search_cli.command("rebuild")
+@click.option("--batch-size", default=1000, show_default=True, help="Number of posts indexed per batch.")
+def rebuild(batch_size):
+    """Re-index every post from scratch."""
+    indexed = 0
+    for indexed in search.rebuild_index(db.session, batch_size=batch_size):
+        click.echo(f"Indexed {indexed} posts...")
+    db.session.commit()
+    click.echo(f"Search index rebuilt with {indexed} posts.")
@@ -0,0 +1,18 @@
+import click
+from flask.cli import AppGroup
+from app.database import db
+from app.services import page_cache, post_stats
+
+stats_cli = AppGroup("stats", help="Manage the denormalized post statistics.")
+
+
+@stats_cli.command("reconcile")
+@click.option("--batch-size", default=1000, show_default=True, help="Number of posts checked per batch.")
+def reconcile(batch_size):
+    """Recompute the comment counts and activity times of every post and repair drift."""
+    progress = None
+    for progress in post_stats.reconcile(db.session, batch_size=batch_size):
+        click.echo(f"Checked {progress.checked} posts...")
+    if progress.repaired:
+        page_cache.invalidate_all()
+    click.echo(f"Post stats reconciled: {progress.checked} posts checked, {progress.repaired} rows repaired.")
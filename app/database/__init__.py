@@ -1,4 +1,4 @@
-from .database import db
+from .database import db, init_db, replica_read, commit_without_expiring, lazy_load_guard
 from .crud_user import *
 from .crud_comment import *
 from .crud_post import *
\ No newline at end of file
@@ -1,63 +1,156 @@
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from typing import Iterator, List, NamedTuple, Optional
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload
 from app.forms import CommentForm
 from app.models import Comment, BlogPost
+from app.models.timestamps import utcnow
+from app.services import page_cache, post_stats, rendering
+from .database import commit_without_expiring, lazy_load_guard
 from flask_login import current_user
 import logging
+logger = logging.getLogger(__name__)
+# The records of the reads, logged on every page view, are sampled by LOG_SAMPLING.
+read_logger = logging.getLogger(f"{__name__}.reads")
 
-def get_comment_by_text(db: Session, comment_form: CommentForm) -> Comment:
+
+def create_comment(db: Session, comment_form: CommentForm, requested_post: BlogPost) -> Optional[Comment]:
     """
-        Retrieves the first comment that matches the text from the given form.
+        Creates a new comment and adds it to the database, unless the current user already posted
+        the same text on this post.
+
+        The duplicate check is the unique index on (post_id, author_id, text_hash), so it costs
+        the insert itself and no lookup, however many comments there are. The post's stats are
+        counted in the same transaction, and the text is compiled to the HTML the post page renders.
 
         Parameters:
         - db (Session): The SQLAlchemy database session.
         - comment_form (FlaskForm): The form submitted by the user, containing the comment text.
+        - requested_post (BlogPost): The post object to which the comment will be associated.
 
         Returns:
-        - Comment: The first Comment object found with the matching text or None if no match is found.
+        - Comment: The new Comment object, or None if it was a duplicate.
 
         Raises:
-        - SQLAlchemyError: An error occurred while querying the database.
+        - SQLAlchemyError: An error occurred while adding the comment to the database.
     """
+    requested_post_id = requested_post.id
     try:
-        comment = db.session.query(Comment).filter(Comment.text == comment_form.comment_text.data).first()
-        if comment:
-            logging.info("Comment retrieved successfully.")
-        else:
-            logging.info("No comment found with the provided text.")
-        return comment
+        new_comment = Comment(
+            text=comment_form.comment_text.data,
+            text_html=rendering.compile_comment(comment_form.comment_text.data),
+            # Set the keys directly so the back-populated collections are not lazy loaded.
+            author_id=current_user.id,
+            post_id=requested_post_id,
+            created_at=utcnow()
+        )
+
+        db.session.add(new_comment)
+        db.session.flush()
+        post_stats.record_comment(db.session, requested_post_id, new_comment.created_at)
+        # Keeps the post loaded for the page that shows the new comment.
+        commit_without_expiring(db.session)
+        # The index pages listing the post show its comment count.
+        page_cache.invalidate_post(requested_post_id)
+        page_cache.invalidate_activity()
+        logger.info("New comment created and added to the database successfully.")
+        return new_comment
+    except IntegrityError:
+        db.session.rollback()
+        logger.info("Duplicate comment on post %s ignored.", requested_post_id)
+        return None
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error retrieving comment: {e}")
+        logger.error("Error creating comment: %s", e)
         raise e
 
 
-def create_comment(db: Session, comment_form: CommentForm, requested_post: BlogPost) -> None:
+class CommentPage(NamedTuple):
+    comments: List[Comment]
+    # The id of the last comment of the page, to pass as after for the next page; None on the last page.
+    next_cursor: Optional[int]
+
+
+def _post_comments_query(db: Session, post_id: int, newest_first: bool = False, after: Optional[int] = None):
+    # Keyset on (created_at, id), read through ix_comments_post_id_created_at. The cursor is a
+    # comment id; its created_at is looked up by primary key in the same statement.
+    query = db.select(Comment).where(Comment.post_id == post_id).options(joinedload(Comment.comment_author),
+                                                                          *lazy_load_guard())
+    if after is not None:
+        cursor_created_at = db.select(Comment.created_at).where(Comment.id == after).scalar_subquery()
+        if newest_first:
+            query = query.where(or_(Comment.created_at < cursor_created_at,
+                                    and_(Comment.created_at == cursor_created_at, Comment.id < after)))
+        else:
+            query = query.where(or_(Comment.created_at > cursor_created_at,
+                                    and_(Comment.created_at == cursor_created_at, Comment.id > after)))
+    if newest_first:
+        return query.order_by(Comment.created_at.desc(), Comment.id.desc())
+    return query.order_by(Comment.created_at, Comment.id)
+
+
+def get_comments_page(db: Session, post_id: int, newest_first: bool = False, after: Optional[int] = None,
+                      page_size: int = 50) -> CommentPage:
     """
-        Creates a new comment and adds it to the database.
+        Retrieves one page of the comments of a post, with their authors, oldest or newest first.
+        A page costs the same however many comments the post has.
 
         Parameters:
         - db (Session): The SQLAlchemy database session.
-        - comment_form (FlaskForm): The form submitted by the user, containing the comment text.
-        - requested_post (BlogPost): The post object to which the comment will be associated.
+        - post_id (int): The id of the post.
+        - newest_first (bool): Whether to page from the newest comment instead of the oldest.
+        - after (int): Only return the comments that come after the comment with this id in that
+          order, i.e. the next_cursor of the previous page.
+        - page_size (int): The maximum number of comments on the page.
 
         Returns:
-        - None
+        - CommentPage: The comments of the page and the cursor of the next page.
 
         Raises:
-        - SQLAlchemyError: An error occurred while adding the comment to the database.
+        - SQLAlchemyError: An error occurred while querying the database.
     """
     try:
-        new_comment = Comment(
-            text=comment_form.comment_text.data,
-            comment_author=current_user,  # Ensure current_user is imported and available in the context
-            parent_post=requested_post
-        )
+        # Fetch one extra row to know whether there is a page beyond this one.
+        comments = db.session.execute(
+            _post_comments_query(db, post_id, newest_first=newest_first, after=after).limit(page_size + 1)
+        ).scalars().all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving a page of the comments of post %s: %s", post_id, e)
+        raise e
 
-        db.session.add(new_comment)
-        db.session.commit()
-        logging.info("New comment created and added to the database successfully.")
+    next_cursor = None
+    if len(comments) > page_size:
+        comments = comments[:page_size]
+        next_cursor = comments[-1].id
+    read_logger.info("Retrieved page of %s comments of post %s.", len(comments), post_id)
+    return CommentPage(comments=comments, next_cursor=next_cursor)
+
+
+def iter_post_comments(db: Session, post_id: int, batch_size: int = 100,
+                       limit: Optional[int] = None) -> Iterator[Comment]:
+    """
+        Yields the comments of a post, oldest first, with their authors, fetching batch_size rows at
+        a time as the caller iterates, so a streamed page can send the first comments before the
+        last ones are read. Reads from the primary: the query runs after replica_read would have
+        returned.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - post_id (int): The id of the post.
+        - batch_size (int): The number of comments fetched per round trip.
+        - limit (int): The maximum number of comments to yield, all of them if None.
+
+        Returns:
+        - Iterator[Comment]: The comments, read through ix_comments_post_id_created_at.
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    query = _post_comments_query(db, post_id).limit(limit).execution_options(yield_per=batch_size)
+    try:
+        yield from db.session.execute(query).scalars()
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error creating comment: {e}")
-        raise e
\ No newline at end of file
+        logger.error("Error reading the comments of post %s: %s", post_id, e)
+        raise e
@@ -1,13 +1,31 @@
 import logging
+from flask import current_app
+from markupsafe import Markup
 from app.forms import CreatePostForm, UpdatePostForm
-from sqlalchemy.exc import SQLAlchemyError
-from typing import List
-from app.models import BlogPost
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from concurrent.futures import Future
+from typing import List, NamedTuple, Optional, Tuple
+from app.models import BlogPost, Comment, PostStats, User
+from app.services import page_cache, post_deletion, rendering, search, syndication
+from sqlalchemy.orm import Session, contains_eager, defer, joinedload
 from flask_login import current_user
-from datetime import date
+from datetime import date, datetime
+from .database import commit_without_expiring, lazy_load_guard, replica_read
+logger = logging.getLogger(__name__)
+# The records of the reads, logged on every page view, are sampled by LOG_SAMPLING.
+read_logger = logging.getLogger(f"{__name__}.reads")
 
 
+def _listing_options() -> list:
+    """
+        Returns loader options for pages listing posts: the bodies stay in the database, the
+        listing shows the excerpt.
+    """
+    return [defer(BlogPost.body), defer(BlogPost.body_html)]
+
+
+@replica_read
 def get_post_by_id(db: Session, post_id: int) -> BlogPost:
     """
             Retrieves a post by id.
@@ -26,17 +44,79 @@ def get_post_by_id(db: Session, post_id: int) -> BlogPost:
     try:
         post = db.session.execute(db.select(BlogPost).where(BlogPost.id == post_id)).scalar()
         if post:
-            logging.info(f"Post with id {post_id} retrieved successfully.")
+            read_logger.info("Post with id %s retrieved successfully.", post_id)
+        else:
+            read_logger.info("No post found with id %s.", post_id)
+        return post
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving post by id %s: %s", post_id, e)
+        raise e
+
+
+@replica_read
+def get_post_with_author(db: Session, post_id: int) -> BlogPost:
+    """
+        Retrieves a post by id with its author, but not its comments, for the streamed post page,
+        which reads them with crud_comment.iter_post_comments while it renders.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - post_id (int): The id of the post to retrieve.
+
+        Returns:
+        - BlogPost: The BlogPost object if found, None otherwise.
+
+        Raises:
+        - SQLAlchemyError: If an error occurs while querying the database.
+    """
+    query = db.select(BlogPost).where(BlogPost.id == post_id).options(joinedload(BlogPost.author), *lazy_load_guard())
+    try:
+        post = db.session.execute(query).scalar()
+        if post:
+            read_logger.info("Post with id %s and its author retrieved successfully.", post_id)
         else:
-            logging.info(f"No post found with id {post_id}.")
+            read_logger.info("No post found with id %s.", post_id)
         return post
 
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error retrieving post by id {post_id}: {e}")
+        logger.error("Error retrieving post with author by id %s: %s", post_id, e)
         raise e
 
 
+@replica_read
+def get_post_last_modified(db: Session, post_id: int) -> Optional[datetime]:
+    """
+        Returns when the post page last changed: the latest of the post's updated_at and the
+        creation of its newest comment. One indexed lookup, without loading the post.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - post_id (int): The id of the post.
+
+        Returns:
+        - datetime: The time of the last change in UTC, or None if there is no such post.
+
+        Raises:
+        - SQLAlchemyError: If an error occurs while querying the database.
+    """
+    latest_comment = db.select(func.max(Comment.created_at)).where(Comment.post_id == BlogPost.id).scalar_subquery()
+    try:
+        row = db.session.execute(
+            db.select(BlogPost.updated_at, latest_comment).where(BlogPost.id == post_id)
+        ).first()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving last modification of post %s: %s", post_id, e)
+        raise e
+    if row is None:
+        return None
+    return max(value for value in row if value is not None)
+
+
+@replica_read
 def get_post_by_title(db: Session, title: str) -> BlogPost:
     """
             Retrieves a post by title.
@@ -55,144 +135,483 @@ def get_post_by_title(db: Session, title: str) -> BlogPost:
     try:
         post = db.session.execute(db.select(BlogPost).where(BlogPost.title == title)).scalar()
         if post:
-            logging.info(f"Post with id {title} retrieved successfully.")
+            read_logger.info("Post with id %s retrieved successfully.", title)
         else:
-            logging.info(f"No post found with id {title}.")
+            read_logger.info("No post found with id %s.", title)
         return post
 
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error retrieving post by id {title}: {e}")
+        logger.error("Error retrieving post by id %s: %s", title, e)
         raise e
 
 
 
-def get_all_posts(db: Session) -> List[BlogPost]:
+class PostSearchResult(NamedTuple):
+    post: BlogPost
+    snippet: Markup
+
+
+@replica_read
+def search_posts(db: Session, query: str, limit: int = 20, offset: int = 0) -> List[PostSearchResult]:
     """
-        Retrieves all the post in the database.
+        Searches the title, subtitle and body of the posts through the full-text index.
 
         Parameters:
         - db (Session): The SQLAlchemy database session.
+        - query (str): The words to search for; a post must contain all of them.
+        - limit (int): The maximum number of results.
+        - offset (int): The number of best results to skip.
 
         Returns:
-        - List[BlogPost]: All posts as list in the database or None if no match is found.
+        - List[PostSearchResult]: The matching posts, best ranked first, with a highlighted snippet.
 
         Raises:
         - SQLAlchemyError: An error occurred while querying the database.
     """
     try:
-        posts = db.session.execute(db.select(BlogPost)).scalars().all()
-        if posts:
-            logging.info("Posts are retrieved successfully.")
-        else:
-            logging.info("No post found in the database.")
-        return posts
+        hits = search.get_search_engine().search(db.session, query, limit=limit, offset=offset)
+        if not hits:
+            read_logger.info("No post found for search %r.", query)
+            return []
+        posts = db.session.execute(
+            db.select(BlogPost)
+            .where(BlogPost.id.in_([hit.post_id for hit in hits]))
+            .options(joinedload(BlogPost.author), *lazy_load_guard())
+        ).scalars().all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error searching posts for %r: %s", query, e)
+        raise e
+
+    posts_by_id = {post.id: post for post in posts}
+    terms = search.tokenize(query)
+    results = []
+    for hit in hits:
+        post = posts_by_id.get(hit.post_id)
+        if post:
+            snippet = hit.snippet or search.make_snippet(search.strip_html(post.body), terms)
+            results.append(PostSearchResult(post=post, snippet=snippet))
+    read_logger.info("Found %s posts for search %r.", len(results), query)
+    return results
+
+
+class PostPage(NamedTuple):
+    posts: List[BlogPost]
+    older_cursor: Optional[int]
+    newer_cursor: Optional[int]
+
+
+@replica_read
+def get_posts_page(db: Session, before: Optional[int] = None, after: Optional[int] = None,
+                   page_size: int = 10) -> PostPage:
+    """
+        Retrieves one page of posts, newest first, using keyset pagination on the post id.
+
+        The cursors are post ids, so every page is a single indexed range scan no matter how
+        deep into the archive it is, and pages stay stable while new posts are added.
+        The author and the stats of each post are joined in the same query.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - before (int): Only return posts older than the post with this id.
+        - after (int): Only return posts newer than the post with this id.
+        - page_size (int): The maximum number of posts on the page.
+
+        Returns:
+        - PostPage: The posts of the page, and the cursors of the older and newer pages
+          (None if there is no such page).
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    query = db.select(BlogPost).options(
+        joinedload(BlogPost.author), joinedload(BlogPost.stats), *_listing_options(), *lazy_load_guard()
+    )
+    if after is not None:
+        query = query.where(BlogPost.id > after).order_by(BlogPost.id.asc())
+    else:
+        if before is not None:
+            query = query.where(BlogPost.id < before)
+        query = query.order_by(BlogPost.id.desc())
+
+    try:
+        # Fetch one extra row to know whether there is a page beyond this one.
+        posts = db.session.execute(query.limit(page_size + 1)).scalars().all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving posts page: %s", e)
+        raise e
+
+    has_more = len(posts) > page_size
+    posts = posts[:page_size]
+    if after is not None:
+        posts.reverse()
+        has_older, has_newer = True, has_more
+    else:
+        has_older, has_newer = has_more, before is not None
+
+    older_cursor = posts[-1].id if posts and has_older else None
+    newer_cursor = posts[0].id if posts and has_newer else None
+    read_logger.info("Retrieved page of %s posts.", len(posts))
+    return PostPage(posts=posts, older_cursor=older_cursor, newer_cursor=newer_cursor)
+
+
+class ActivityPage(NamedTuple):
+    posts: List[BlogPost]
+    older_cursor: Optional[Tuple[datetime, int]]
+
+
+@replica_read
+def get_active_posts_page(db: Session, before: Optional[Tuple[datetime, int]] = None,
+                          page_size: int = 10) -> ActivityPage:
+    """
+        Retrieves one page of posts, most recently active first: by the time of their newest
+        comment, or of their creation if they have none.
+
+        The order is read from the post_stats rows through ix_post_stats_activity, so a page is
+        one indexed range scan, with no aggregation over the comments. The cursor is the
+        (last_activity_at, post_id) of the last post of the previous page.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - before (Tuple[datetime, int]): Only return posts less recently active than this cursor.
+        - page_size (int): The maximum number of posts on the page.
+
+        Returns:
+        - ActivityPage: The posts of the page, with their author and stats, and the cursor of the
+          next page (None if there is no such page).
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    query = (
+        db.select(BlogPost).join(PostStats, PostStats.post_id == BlogPost.id)
+        .options(contains_eager(BlogPost.stats), joinedload(BlogPost.author), *_listing_options(),
+                 *lazy_load_guard())
+        .order_by(PostStats.last_activity_at.desc(), PostStats.post_id.desc())
+    )
+    if before is not None:
+        last_activity_at, post_id = before
+        query = query.where(or_(
+            PostStats.last_activity_at < last_activity_at,
+            and_(PostStats.last_activity_at == last_activity_at, PostStats.post_id < post_id)
+        ))
+
+    try:
+        # Fetch one extra row to know whether there is a page beyond this one.
+        posts = db.session.execute(query.limit(page_size + 1)).scalars().all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving page of active posts: %s", e)
+        raise e
+
+    older_cursor = None
+    if len(posts) > page_size:
+        posts = posts[:page_size]
+        older_cursor = (posts[-1].stats.last_activity_at, posts[-1].id)
+    read_logger.info("Retrieved page of %s active posts.", len(posts))
+    return ActivityPage(posts=posts, older_cursor=older_cursor)
+
+
+def get_most_viewed_posts(db: Session, limit: int = 10) -> List[BlogPost]:
+    """
+        Retrieves the most viewed posts, most views first.
+
+        The order is read from the post_stats rows through ix_post_stats_view_count. The counts
+        are written behind by the view counter, so they lag the latest views by a few seconds.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - limit (int): The maximum number of posts to return.
+
+        Returns:
+        - List[BlogPost]: The posts, with their author and stats.
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    query = (
+        db.select(BlogPost).join(PostStats, PostStats.post_id == BlogPost.id)
+        .options(contains_eager(BlogPost.stats), joinedload(BlogPost.author), *_listing_options(),
+                 *lazy_load_guard())
+        .order_by(PostStats.view_count.desc(), PostStats.post_id.desc())
+        .limit(limit)
+    )
+    try:
+        posts = db.session.execute(query).scalars().all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving most viewed posts: %s", e)
+        raise e
+    read_logger.info("Retrieved %s most viewed posts.", len(posts))
+    return posts
+
+
+def get_latest_posts(db: Session, limit: int) -> List[BlogPost]:
+    """
+        Retrieves the newest posts with their authors, e.g. for the feed.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - limit (int): The maximum number of posts.
+
+        Returns:
+        - List[BlogPost]: The posts, newest first.
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    try:
+        return db.session.execute(
+            db.select(BlogPost).options(joinedload(BlogPost.author), *lazy_load_guard())
+            .order_by(BlogPost.id.desc()).limit(limit)
+        ).scalars().all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving latest posts: %s", e)
+        raise e
+
+
+# The fields of the posts API, by name, and the column each is read from.
+POST_FIELDS = {
+    "id": BlogPost.id,
+    "title": BlogPost.title,
+    "subtitle": BlogPost.subtitle,
+    "date": BlogPost.date,
+    "author": User.name,
+    "img_url": BlogPost.img_url,
+    "excerpt": BlogPost.excerpt,
+    "body_html": BlogPost.body_html,
+    "created_at": BlogPost.created_at,
+    "updated_at": BlogPost.updated_at,
+    "comment_count": PostStats.comment_count,
+    "view_count": PostStats.view_count,
+}
+
+
+@replica_read
+def get_post_fields(db: Session, fields: List[str], ids: Optional[List[int]] = None, before: Optional[int] = None,
+                    limit: int = 10) -> List[dict]:
+    """
+        Retrieves the given fields of posts, newest first, selecting only their columns and
+        joining the users and post_stats tables only when a field needs them. The id is always
+        included.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - fields (List[str]): Names of POST_FIELDS to read.
+        - ids (List[int]): Only return the posts with these ids, in one query; before and limit
+          are then ignored.
+        - before (int): Only return posts older than the post with this id.
+        - limit (int): The maximum number of posts to return.
+
+        Returns:
+        - List[dict]: One dict of field values per post.
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    fields = ["id", *(field for field in fields if field != "id")]
+    query = db.select(*(POST_FIELDS[field].label(field) for field in fields)).select_from(BlogPost)
+    if "author" in fields:
+        query = query.outerjoin(User, User.id == BlogPost.author_id)
+    if {"comment_count", "view_count"} & set(fields):
+        query = query.outerjoin(PostStats, PostStats.post_id == BlogPost.id)
+    if ids is not None:
+        query = query.where(BlogPost.id.in_(ids))
+    else:
+        if before is not None:
+            query = query.where(BlogPost.id < before)
+        query = query.limit(limit)
+    try:
+        rows = db.session.execute(query.order_by(BlogPost.id.desc())).mappings().all()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving fields %s of posts: %s", fields, e)
+        raise e
+    read_logger.info("Retrieved %s fields of %s posts.", len(fields), len(rows))
+    return [dict(row) for row in rows]
+
+
+class SitemapEntry(NamedTuple):
+    id: int
+    updated_at: datetime
+
+
+def get_post_sitemap_entries(db: Session, first_id: int, last_id: int) -> List[SitemapEntry]:
+    """
+        Retrieves the id and last update of the posts whose id is between first_id and last_id, inclusive,
+        without loading the posts themselves.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - first_id (int): The lowest post id of the range.
+        - last_id (int): The highest post id of the range.
+
+        Returns:
+        - List[SitemapEntry]: The entries, in id order.
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    try:
+        rows = db.session.execute(
+            db.select(BlogPost.id, BlogPost.updated_at)
+            .where(BlogPost.id.between(first_id, last_id)).order_by(BlogPost.id)
+        ).all()
+        return [SitemapEntry(id=row.id, updated_at=row.updated_at) for row in rows]
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error retrieving sitemap entries %s-%s: %s", first_id, last_id, e)
+        raise e
+
+
+def get_last_post_id(db: Session) -> Optional[int]:
+    """
+        Returns the highest post id, or None when there are no posts.
+
+        Raises:
+        - SQLAlchemyError: An error occurred while querying the database.
+    """
+    try:
+        return db.session.execute(db.select(func.max(BlogPost.id))).scalar()
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error retrieving posts: {e}")
+        logger.error("Error retrieving the last post id: %s", e)
         raise e
 
 
-def create_new_post(db: Session, create_post_form: CreatePostForm) -> BlogPost:
+def create_new_post(db: Session, create_post_form: CreatePostForm) -> Optional[BlogPost]:
     """
-        Creates a new post with the provided details
+        Creates a new post with the provided details, with its body compiled for rendering, unless
+        there is already a post with the same title.
+
+        The duplicate check is the unique index on the title, so it costs the insert itself and no
+        lookup. The post is not read back after the commit: it holds every value written.
 
         Parameters:
         - db (Session) - The SQLAlchemy database session.
         - create_post_form (CreatePostForm): The post creation form containing post details.
 
         Returns:
-        - BlogPost: The newly created BlogPost object, or None if creation failed.
+        - BlogPost: The newly created BlogPost object, or None if the title is taken.
 
         Raises:
-        - Exception: If an unexpected error occurs during post creation.
+        - SQLAlchemyError: An error occurred while adding the post to the database.
 
     """
 
+    compiled = rendering.compile_post(create_post_form.body.data)
     new_post = BlogPost(
         title=create_post_form.title.data,
         subtitle=create_post_form.subtitle.data,
         body=create_post_form.body.data,
+        body_html=compiled.body_html,
+        excerpt=compiled.excerpt,
         img_url=create_post_form.img_url.data,
-        author=current_user,
+        author_id=current_user.id,
         date=date.today().strftime("%B %d, %Y")
     )
 
     try:
         db.session.add(new_post)
-        db.session.commit()
-        db.session.refresh(new_post)
-        logging.info(f"Post {new_post.title} created successfully.")
+        db.session.flush()
+        search.get_search_engine().index_post(db.session, new_post.id, new_post.title, new_post.subtitle,
+                                               new_post.body)
+        commit_without_expiring(db.session)
+        page_cache.invalidate_index_head()
+        page_cache.invalidate_activity()
+        syndication.invalidate_post(new_post.id, listing_changed=True)
+        logger.info("Post %s created successfully.", new_post.title)
         return new_post
+    except IntegrityError:
+        db.session.rollback()
+        logger.warning("Post title %s already exists.", create_post_form.title.data)
+        return None
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error creating post {create_post_form.title}: {e}")
-        raise e
-    except Exception as e:
-        logging.error(f"Unexpected error occured: {e}")
+        logger.error("Error creating post %s: %s", create_post_form.title.data, e)
         raise e
 
 
-def update_post(db: Session, update_form: UpdatePostForm, post_to_update: BlogPost):
+def update_post(db: Session, update_form: UpdatePostForm, post_to_update: BlogPost) -> Optional[BlogPost]:
     """
-        Updates a created post.
+        Updates a created post and recompiles its body for rendering, unless the new title is the
+        title of another post, which the unique index on the title reports on the update itself.
 
         Parameters:
         - db (Session): The SQLAlchemy database session.
-        - create_post_form (CreatePostForm): The post update form containing post details.
+        - update_form (UpdatePostForm): The post update form containing post details.
         - post_to_update (BlogPost): The post object that will be updated.
         Returns:
-        - BlogPost: The updated BlogPost object, or None if creation failed.
+        - BlogPost: The updated BlogPost object, or None if the title is taken.
 
         Raises:
-        - Exception: If an unexpected error occurs during post creation.
+        - SQLAlchemyError: An error occurred while updating the post.
 
     """
 
     post_to_update.title = update_form.title.data
     post_to_update.subtitle = update_form.subtitle.data
-    post_to_update.author = current_user
+    post_to_update.author_id = current_user.id
     post_to_update.img_url = update_form.img_url.data
     post_to_update.body = update_form.body.data
+    post_to_update.body_html, post_to_update.excerpt = rendering.compile_post(post_to_update.body)
+    post_id = post_to_update.id
 
     try:
-        db.session.commit()
-        db.session.refresh(post_to_update)
-        logging.info(f"Post {post_to_update.title} updated successfully.")
+        search.get_search_engine().index_post(db.session, post_id, post_to_update.title,
+                                               post_to_update.subtitle, post_to_update.body)
+        commit_without_expiring(db.session)
+        page_cache.invalidate_post(post_id)
+        syndication.invalidate_post(post_id)
+        logger.info("Post %s updated successfully.", post_to_update.title)
         return post_to_update
+    except IntegrityError:
+        db.session.rollback()
+        logger.warning("Post title %s already exists.", update_form.title.data)
+        return None
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error updating post {update_form.title}: {e}")
-        raise e
-    except Exception as e:
-        logging.error(f"Unexpected error occurred: {e}")
+        logger.error("Error updating post %s: %s", update_form.title.data, e)
         raise e
 
 
-def delete_post(db: Session, post_id: int):
+def delete_post(db: Session, post_id: int) -> Optional[Future]:
     """
-        Deletes a post that is specified by post id.
+        Deletes a post that is specified by post id, with its comments, stats row and search entry.
+
+        The comments are deleted in batches of POST_DELETE_BATCH_SIZE with set-based DELETE
+        statements, never loaded. A post with at least POST_DELETE_BACKGROUND_THRESHOLD comments
+        is deleted by a background thread, and stays visible until it is done.
 
         Parameters:
         - db (Session): The SQLAlchemy database session.
         - post_id (int): The id number of the post to be deleted.
 
         Returns:
-        - None
-    """
+        - Future: The background deletion of the post, or None if it was deleted already, or does
+          not exist.
 
-    post_to_delete = get_post_by_id(db=db, post_id=post_id)
-    if post_to_delete:
-        try:
-            db.session.delete(post_to_delete)
-            db.session.commit()
-            logging.info(f"Post: {post_to_delete.title} deleted successfully.")
-        except SQLAlchemyError as e:
+        Raises:
+        - SQLAlchemyError: An error occurred while deleting the post.
+    """
+    try:
+        comment_count = db.session.execute(
+            db.select(PostStats.comment_count).select_from(BlogPost)
+            .outerjoin(PostStats, PostStats.post_id == BlogPost.id).where(BlogPost.id == post_id)
+        ).first()
+        if comment_count is None:
+            logger.warning("Attempted to delete a non-existing post with id: %s", post_id)
+            return None
+        if post_deletion.runs_in_background(comment_count[0]):
+            logger.info("Post %s with %s comments will be deleted in the background.", post_id, comment_count[0])
             db.session.rollback()
-            logging.error(f"Error deleting Post: {post_to_delete.title}: {e}")
-            raise
-        except Exception as e:
-            logging.error(f"Unexpected error occurred: {e}")
-            raise
-    else:
-        logging.warning(f"Attempted to delete a non-existing post with id: {post_id}")
\ No newline at end of file
+            return post_deletion.get_post_deleter().submit(post_id)
+        post_deletion.delete_post(db.session, post_id, batch_size=current_app.config["POST_DELETE_BATCH_SIZE"])
+        return None
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error deleting post %s: %s", post_id, e)
+        raise e
@@ -1,10 +1,14 @@
-from sqlalchemy.exc import SQLAlchemyError
-from app.services import authentication
+from typing import Optional
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app.services import authentication, identity_cache
 from app.models import User
 from sqlalchemy.orm import Session
 from app.forms import RegisterUserForm
 import logging
+from .database import commit_without_expiring, replica_read
+logger = logging.getLogger(__name__)
 
+@replica_read
 def get_user_by_mail(db: Session, email: str) -> User:
     """
         Retrieves a user by email.
@@ -22,29 +26,32 @@ def get_user_by_mail(db: Session, email: str) -> User:
     try:
         user = db.session.query(User).filter(User.email == email).first()
         if user:
-            logging.info(f"User with email {email} retrieved successfully.")
+            logger.info("User with email %s retrieved successfully.", email)
         else:
-            logging.info(f"No user found with email {email}.")
+            logger.info("No user found with email %s.", email)
         return user
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error retrieving user by email {email}: {e}")
+        logger.error("Error retrieving user by email %s: %s", email, e)
         raise e
 
 
-def create_user(db: Session, register_form: RegisterUserForm) -> User:
+def create_user(db: Session, register_form: RegisterUserForm) -> Optional[User]:
     """
-        Creates a new user with the provided details.
+        Creates a new user with the provided details, unless the email is already registered.
+
+        The duplicate check is the unique index on the email, so registering costs the insert
+        alone. The user is not read back after the commit: it holds every value written.
 
         Parameters:
         - db (Session): The SQLAlchemy database session.
         - register_form (RegisterUserForm): The registration form containing user details.
 
         Returns:
-        - User: The newly created User object, or None if creation failed.
+        - User: The newly created User object, or None if the email is already registered.
 
         Raises:
-        - Exception: If an unexpected error occurs during user creation.
+        - SQLAlchemyError: An error occurred while adding the user to the database.
     """
     password_to_save = authentication.hash_user_password(register_form.password.data)
     user_to_register = User(
@@ -55,15 +62,41 @@ def create_user(db: Session, register_form: RegisterUserForm) -> User:
 
     try:
         db.session.add(user_to_register)
-        db.session.commit()
-        db.session.refresh(user_to_register)
-        logging.info(f"User {user_to_register.email} created successfully.")
+        commit_without_expiring(db.session)
+        logger.info("User %s created successfully.", user_to_register.email)
         return user_to_register
+    except IntegrityError:
+        db.session.rollback()
+        logger.info("User %s already exists.", register_form.email.data)
+        return None
     except SQLAlchemyError as e:
         db.session.rollback()
-        logging.error(f"Error creating user {register_form.email.data}: {e}")
-        raise e
-    except Exception as e:
-        logging.error(f"Unexpected error occurred: {e}")
+        logger.error("Error creating user %s: %s", register_form.email.data, e)
         raise e
 
+
+def update_user_password(db: Session, user: User, password: str) -> User:
+    """
+        Stores a new hash of the user's password made with the current hashing parameters.
+
+        Parameters:
+        - db (Session): The SQLAlchemy database session.
+        - user (User): The user whose password is rehashed.
+        - password (str): The plain password, as just verified at login.
+
+        Returns:
+        - User: The updated User object.
+
+        Raises:
+        - SQLAlchemyError: If an error occurs while updating the database.
+    """
+    user.password = authentication.hash_user_password(password)
+    try:
+        db.session.commit()
+        identity_cache.invalidate_user(user.id)
+        logger.info("Password hash of user %s upgraded.", user.id)
+        return user
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error("Error updating password of user %s: %s", user.id, e)
+        raise e
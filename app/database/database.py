@@ -1,2 +1,114 @@
+from functools import partial, wraps
+
+from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
\ No newline at end of file
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload, scoped_session
+
+from .routing import ReplicaRouter, RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+_SQLITE_PRAGMAS = (
+    ("journal_mode", "SQLITE_JOURNAL_MODE"),
+    ("synchronous", "SQLITE_SYNCHRONOUS"),
+    ("mmap_size", "SQLITE_MMAP_SIZE"),
+    ("cache_size", "SQLITE_CACHE_SIZE"),
+    ("busy_timeout", "SQLITE_BUSY_TIMEOUT"),
+)
+
+
+def engine_options(config) -> dict:
+    """
+        Builds SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings. Pool sizing is only passed
+        for server databases, SQLite keeps the pool class SQLAlchemy picks for it.
+    """
+    options = {"pool_pre_ping": bool(config.get("DB_POOL_PRE_PING"))}
+    if config.get("DB_POOL_RECYCLE") is not None:
+        options["pool_recycle"] = config["DB_POOL_RECYCLE"]
+    if not (config.get("SQLALCHEMY_DATABASE_URI") or "").startswith("sqlite"):
+        for option, setting in (("pool_size", "DB_POOL_SIZE"), ("max_overflow", "DB_MAX_OVERFLOW")):
+            if config.get(setting) is not None:
+                options[option] = config[setting]
+    return options
+
+
+def replica_read(function):
+    """
+        Sends the queries of the decorated crud function to a read replica, when replicas are
+        configured and the session has not written yet.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        info = db.session.info
+        previous = info.get("replica_read", False)
+        info["replica_read"] = True
+        try:
+            return function(*args, **kwargs)
+        finally:
+            info["replica_read"] = previous
+    return wrapper
+
+
+def lazy_load_guard() -> list:
+    """
+        Returns loader options that make any relationship not eager loaded by the query raise
+        on access, when RAISE_ON_LAZY_LOAD is enabled (it is in test mode).
+    """
+    if current_app.config.get("RAISE_ON_LAZY_LOAD"):
+        return [raiseload("*")]
+    return []
+
+
+def commit_without_expiring(session):
+    """
+        Commits the session without expiring its instances, so reading the rows just written
+        afterwards does not SELECT them back. Every column of the models has a Python-side default,
+        or a primary key the flush fetched, so the instances already hold what the database does.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    expire_on_commit = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        session.commit()
+    finally:
+        session.expire_on_commit = expire_on_commit
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas:
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def init_db(app: Flask):
+    """
+        Initialises db with the engine options of the app config, letting explicit
+        SQLALCHEMY_ENGINE_OPTIONS win, runs the SQLITE_* PRAGMAs on every new SQLite connection
+        and sets up the routing of reads to the DB_REPLICA_BINDS.
+    """
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options(app.config), **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    }
+    db.init_app(app)
+    replica_binds = app.config.get("DB_REPLICA_BINDS", [])
+    # Replicas get the schema from the primary; without metadata of their own, create_all and
+    # drop_all leave them alone.
+    for key in replica_binds:
+        if key in db.metadatas and not db.metadatas[key].tables:
+            del db.metadatas[key]
+    app.extensions["db_router"] = ReplicaRouter(
+        replica_binds,
+        health_check_interval=app.config.get("DB_REPLICA_HEALTH_CHECK_INTERVAL", 5),
+        sticky_seconds=app.config.get("DB_REPLICA_STICKY_SECONDS", 5)
+    )
+
+    pragmas = [(name, app.config[setting]) for name, setting in _SQLITE_PRAGMAS if app.config.get(setting) is not None]
+    if not pragmas:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", partial(_apply_sqlite_pragmas, pragmas=pragmas))
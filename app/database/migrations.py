@@ -0,0 +1,220 @@
+"""
+Ordered, idempotent schema migrations for databases created before a model change.
+
+Fresh databases get the current schema from db.create_all(); every migration checks what is
+already there, so running them against a fresh database only records them as applied.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Connection, DateTime, bindparam, inspect, text
+from sqlalchemy.orm import Session
+
+from app.models import Comment, PostStats, SearchTerm
+from app.models.timestamps import utcnow
+from app.services import search
+
+logger = logging.getLogger(__name__)
+
+_BATCH_SIZE = 1000
+
+
+def _column_names(connection: Connection, table: str) -> set:
+    return {column["name"] for column in inspect(connection).get_columns(table)}
+
+
+def _index_names(connection: Connection, table: str) -> set:
+    return {index["name"] for index in inspect(connection).get_indexes(table)}
+
+
+def comment_text_hash(connection: Connection):
+    """
+        Adds comments.text_hash, backfills it in batches, drops exact duplicates of the same
+        author on the same post (keeping the oldest, logging the ids of the others) and creates
+        the unique index.
+    """
+    if "text_hash" not in _column_names(connection, "comments"):
+        connection.execute(text("ALTER TABLE comments ADD COLUMN text_hash VARCHAR(64)"))
+
+    backfilled = 0
+    while True:
+        rows = connection.execute(
+            text("SELECT id, text FROM comments WHERE text_hash IS NULL ORDER BY id LIMIT :limit"),
+            {"limit": _BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            text("UPDATE comments SET text_hash = :text_hash WHERE id = :id"),
+            [{"id": row.id, "text_hash": Comment.hash_text(row.text)} for row in rows]
+        )
+        backfilled += len(rows)
+    logger.info("Backfilled text_hash of %s comments.", backfilled)
+
+    if "uq_comments_post_author_text_hash" not in _index_names(connection, "comments"):
+        # Comments without a post or an author never conflict in the index, they are left alone.
+        duplicate_ids = connection.execute(text(
+            "SELECT id FROM comments WHERE post_id IS NOT NULL AND author_id IS NOT NULL AND id NOT IN "
+            "(SELECT MIN(id) FROM comments WHERE post_id IS NOT NULL AND author_id IS NOT NULL "
+            "GROUP BY post_id, author_id, text_hash) ORDER BY id"
+        )).scalars().all()
+        delete_comments = text("DELETE FROM comments WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+        for start in range(0, len(duplicate_ids), _BATCH_SIZE):
+            batch = duplicate_ids[start:start + _BATCH_SIZE]
+            connection.execute(delete_comments, {"ids": batch})
+            logger.warning("Removed duplicate comments %s.", ", ".join(str(comment_id) for comment_id in batch))
+        logger.info("Removed %s duplicate comments.", len(duplicate_ids))
+        connection.execute(text(
+            "CREATE UNIQUE INDEX uq_comments_post_author_text_hash ON comments (post_id, author_id, text_hash)"
+        ))
+
+
+def _parse_post_date(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%B %d, %Y")
+    except (TypeError, ValueError):
+        return utcnow()
+
+
+def timestamps_and_foreign_key_indexes(connection: Connection):
+    """
+        Adds created_at and updated_at to blog_posts, backfilled in batches from the display date,
+        and created_at to comments, backfilled with the creation time of their post. Then indexes
+        the timestamps and the author_id foreign keys.
+    """
+    for table, columns in (("blog_posts", ("created_at", "updated_at")), ("comments", ("created_at",))):
+        existing = _column_names(connection, table)
+        for column in columns:
+            if column not in existing:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} DATETIME"))
+
+    set_post_timestamps = text(
+        "UPDATE blog_posts SET created_at = :created_at, updated_at = :created_at WHERE id = :id"
+    ).bindparams(bindparam("created_at", type_=DateTime))
+    backfilled = 0
+    while True:
+        rows = connection.execute(
+            text("SELECT id, date FROM blog_posts WHERE created_at IS NULL ORDER BY id LIMIT :limit"),
+            {"limit": _BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+        connection.execute(set_post_timestamps,
+                           [{"id": row.id, "created_at": _parse_post_date(row.date)} for row in rows])
+        backfilled += len(rows)
+    logger.info("Backfilled created_at of %s posts.", backfilled)
+
+    backfilled = connection.execute(text(
+        "UPDATE comments SET created_at = "
+        "(SELECT blog_posts.created_at FROM blog_posts WHERE blog_posts.id = comments.post_id) "
+        "WHERE created_at IS NULL"
+    )).rowcount
+    connection.execute(
+        text("UPDATE comments SET created_at = :now WHERE created_at IS NULL").bindparams(
+            bindparam("now", type_=DateTime)),
+        {"now": utcnow()}
+    )
+    logger.info("Backfilled created_at of %s comments.", backfilled)
+
+    for table, name, columns in (
+        ("blog_posts", "ix_blog_posts_author_id", "author_id"),
+        ("blog_posts", "ix_blog_posts_created_at", "created_at"),
+        ("blog_posts", "ix_blog_posts_updated_at", "updated_at"),
+        ("comments", "ix_comments_author_id", "author_id"),
+        ("comments", "ix_comments_post_id_created_at", "post_id, created_at"),
+    ):
+        if name not in _index_names(connection, table):
+            connection.execute(text(f"CREATE INDEX {name} ON {table} ({columns})"))
+
+
+def post_stats(connection: Connection):
+    """
+        Creates post_stats and fills in the rows missing from it with one grouped query over the
+        comments.
+    """
+    PostStats.__table__.create(connection, checkfirst=True)
+    created = connection.execute(text(
+        "INSERT INTO post_stats (post_id, comment_count, last_comment_at, last_activity_at, view_count) "
+        "SELECT blog_posts.id, COUNT(comments.id), MAX(comments.created_at), blog_posts.created_at, 0 "
+        "FROM blog_posts LEFT JOIN comments ON comments.post_id = blog_posts.id "
+        "WHERE blog_posts.id NOT IN (SELECT post_id FROM post_stats) "
+        "GROUP BY blog_posts.id, blog_posts.created_at"
+    )).rowcount
+    connection.execute(text(
+        "UPDATE post_stats SET last_activity_at = last_comment_at WHERE last_comment_at > last_activity_at"
+    ))
+    logger.info("Created the stats of %s posts.", created)
+
+
+def compiled_html_columns(connection: Connection):
+    """
+        Adds the compiled HTML and excerpt columns. They are filled in by flask content compile,
+        the pages sanitize rows without them on the fly until then.
+    """
+    for table, columns in (("blog_posts", ("body_html", "excerpt")), ("comments", ("text_html",))):
+        existing = _column_names(connection, table)
+        for column in columns:
+            if column not in existing:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} TEXT"))
+
+
+def post_stats_view_count_index(connection: Connection):
+    """
+        Indexes post_stats.view_count for the most viewed posts.
+    """
+    if "ix_post_stats_view_count" not in _index_names(connection, "post_stats"):
+        connection.execute(text("CREATE INDEX ix_post_stats_view_count ON post_stats (view_count, post_id)"))
+
+
+def search_index(connection: Connection):
+    """
+        Creates search_terms and, on SQLite, the post_search FTS5 table. When the index of the
+        configured search engine is empty while there are posts, indexes every post into it like
+        flask search rebuild. Emptiness rather than a missing table decides: with DB_CREATE_ALL the
+        app creates the empty tables at startup, before the migration runs.
+    """
+    engine = search.get_search_engine()
+    SearchTerm.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == "sqlite":
+        search.create_fts_table(connection)
+    index_table = "post_search" if engine.name == search.SQLiteFTSEngine.name else "search_terms"
+    index_is_empty = connection.execute(text(f"SELECT 1 FROM {index_table} LIMIT 1")).first() is None
+    has_posts = connection.execute(text("SELECT 1 FROM blog_posts LIMIT 1")).first() is not None
+    if not (index_is_empty and has_posts):
+        return
+    indexed = 0
+    with Session(bind=connection) as session:
+        for indexed in search.rebuild_index(session, batch_size=_BATCH_SIZE):
+            logger.info("Indexed %s posts.", indexed)
+    logger.info("Search index built with %s posts.", indexed)
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_comment_text_hash", comment_text_hash),
+    ("0002_timestamps_and_foreign_key_indexes", timestamps_and_foreign_key_indexes),
+    ("0003_post_stats", post_stats),
+    ("0004_compiled_html_columns", compiled_html_columns),
+    ("0005_post_stats_view_count_index", post_stats_view_count_index),
+    ("0006_search_index", search_index),
+]
+
+
+def upgrade(connection: Connection) -> List[str]:
+    """
+        Applies the migrations not yet recorded in schema_migrations, in order.
+
+        Returns:
+        - List[str]: The names of the migrations applied by this call.
+    """
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(100) PRIMARY KEY)"))
+    applied = set(connection.execute(text("SELECT name FROM schema_migrations")).scalars())
+    newly_applied = []
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        logger.info("Applying migration %s.", name)
+        migration(connection)
+        connection.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+        newly_applied.append(name)
+    return newly_applied
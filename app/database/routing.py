@@ -0,0 +1,115 @@
+"""
+Read/write routing of db.session between the primary database and its read replicas.
+
+Replicas are Flask-SQLAlchemy binds listed in DB_REPLICA_BINDS. Queries run by functions
+decorated with replica_read go to a healthy replica, picked round-robin; everything else,
+including every flush and DML statement, goes to the primary. After a session writes, it
+reads from the primary for the rest of its life, and so does the visitor for
+DB_REPLICA_STICKY_SECONDS, so users see their own writes while the replicas catch up.
+"""
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from flask import current_app, has_request_context, session as browser_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+STICKY_SESSION_KEY = "db_primary_until"
+
+
+class ReplicaRouter:
+    """
+        Round-robin over the replica binds, skipping replicas whose last health check failed.
+        A replica is checked with SELECT 1 when picked, at most once per health_check_interval.
+    """
+
+    def __init__(self, bind_keys: Iterable[str], health_check_interval: float, sticky_seconds: float):
+        self.bind_keys = list(bind_keys)
+        self.health_check_interval = health_check_interval
+        self.sticky_seconds = sticky_seconds
+        self._cycle = itertools.cycle(self.bind_keys)
+        self._healthy = {key: True for key in self.bind_keys}
+        self._checked_at = {key: float("-inf") for key in self.bind_keys}
+        self._lock = threading.Lock()
+
+    def _is_healthy(self, key: str, engine: Engine) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at[key] < self.health_check_interval:
+                return self._healthy[key]
+            self._checked_at[key] = now
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            healthy = True
+        except SQLAlchemyError as e:
+            healthy = False
+            logger.warning("Health check of replica %s failed: %s", key, e)
+        if healthy and not self._healthy[key]:
+            logger.info("Replica %s is healthy again.", key)
+        self._healthy[key] = healthy
+        return healthy
+
+    def pick(self, engines: Dict[Optional[str], Engine]) -> Optional[Engine]:
+        """
+            Returns the engine of the next healthy replica, or None when none is healthy.
+        """
+        for _ in range(len(self.bind_keys)):
+            with self._lock:
+                key = next(self._cycle)
+            if self._is_healthy(key, engines[key]):
+                return engines[key]
+        return None
+
+
+def get_replica_router() -> Optional[ReplicaRouter]:
+    router = current_app.extensions.get("db_router")
+    return router if router is not None and router.bind_keys else None
+
+
+def _sticky_to_primary() -> bool:
+    return has_request_context() and browser_session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if clause is not None and getattr(clause, "is_dml", False):
+            self._record_write()
+            return engine
+        if (bind is not None or not self.info.get("replica_read") or self._flushing
+                or self.info.get("wrote") or engine is not self._db.engines.get(None)):
+            return engine
+        router = get_replica_router()
+        if router is None or _sticky_to_primary():
+            return engine
+        return router.pick(self._db.engines) or engine
+
+    def _record_write(self):
+        self.info["wrote"] = True
+        self.info["uncommitted_write"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _after_flush(session, flush_context):
+    session._record_write()
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _after_commit(session):
+    if session.info.pop("uncommitted_write", False) and has_request_context():
+        router = get_replica_router()
+        if router is not None:
+            browser_session[STICKY_SESSION_KEY] = time.time() + router.sticky_seconds
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("uncommitted_write", None)
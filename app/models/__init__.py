@@ -1,3 +1,5 @@
 from .user import User
 from .blog_post import BlogPost
-from .comment import Comment
\ No newline at end of file
+from .comment import Comment
+from .search_term import SearchTerm
+from .post_stats import PostStats
@@ -1,5 +1,6 @@
 from app.database import db
 from sqlalchemy.orm import relationship
+from .timestamps import utcnow
 
 
 # CONFIGURE TABLES
@@ -7,13 +8,22 @@ class BlogPost(db.Model):
     __tablename__ = "blog_posts"
     id = db.Column(db.Integer, primary_key=True)
     # Create Foreign Key, "users.id" the users refers to the tablename of User.
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
     # Create reference to the User object. The "posts" refers to the posts property in the User class.
     author = relationship("User", back_populates="posts")
     title = db.Column(db.String(250), unique=True, nullable=False)
     subtitle = db.Column(db.String(250), nullable=False)
+    # The display date, e.g. "May 01, 2024". Order and filter by created_at.
     date = db.Column(db.String(250), nullable=False)
+    # UTC. updated_at changes with every update of the row and drives the caching of the post page.
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow, index=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow, index=True)
     body = db.Column(db.Text, nullable=False)
+    # Compiled from body by app.services.rendering when the post is saved; the pages render these.
+    body_html = db.Column(db.Text)
+    excerpt = db.Column(db.Text)
     img_url = db.Column(db.String(250), nullable=False)
     # Parent relationship to the comments
     comments = relationship("Comment", back_populates="parent_post")
+    # Written by the post_stats events and crud, never through this relationship.
+    stats = relationship("PostStats", uselist=False, viewonly=True)
@@ -1,17 +1,36 @@
+import hashlib
 from app.database import db
 from sqlalchemy.orm import relationship
+from .timestamps import utcnow
 
 
 class Comment(db.Model):
     __tablename__ = "comments"
+    # A user can post the same text only once per post. Checked by the insert itself.
+    # The comments of a post, and the latest of them, are read through ix_comments_post_id_created_at.
+    __table_args__ = (
+        db.Index("uq_comments_post_author_text_hash", "post_id", "author_id", "text_hash", unique=True),
+        db.Index("ix_comments_post_id_created_at", "post_id", "created_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
+    # Compiled from text by app.services.rendering when the comment is saved; the post page renders it.
+    text_html = db.Column(db.Text)
+    # SHA-256 of the whitespace-normalized text, filled in from the text on insert.
+    text_hash = db.Column(db.String(64), nullable=False,
+                          default=lambda context: Comment.hash_text(context.get_current_parameters()["text"]))
 
     # Child relationship:"users.id" The users refers to the tablename of the User class.
     # "comments" refers to the comments property in the User class.
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
     comment_author = relationship("User", back_populates="comments")
     # Child Relationship to the BlogPosts
     post_id = db.Column(db.Integer, db.ForeignKey("blog_posts.id"))
     parent_post = relationship("BlogPost", back_populates="comments")
+    # UTC.
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
@@ -0,0 +1,31 @@
+from app.database import db
+from sqlalchemy import event, insert
+from .blog_post import BlogPost
+
+
+# Per post counters kept up to date by the writes, so listings never aggregate the comments.
+# The row is created with its post and deleted by app.services.post_deletion; flask stats reconcile
+# repairs any drift.
+class PostStats(db.Model):
+    __tablename__ = "post_stats"
+    # The index pages sorted by activity and by views are range scans of these indexes.
+    __table_args__ = (
+        db.Index("ix_post_stats_activity", "last_activity_at", "post_id"),
+        db.Index("ix_post_stats_view_count", "view_count", "post_id"),
+    )
+
+    post_id = db.Column(db.Integer, db.ForeignKey("blog_posts.id"), primary_key=True)
+    comment_count = db.Column(db.Integer, nullable=False, default=0)
+    # UTC. last_activity_at is the latest of the post creation and its newest comment.
+    last_comment_at = db.Column(db.DateTime)
+    last_activity_at = db.Column(db.DateTime, nullable=False)
+    # Written behind by app.services.view_counter, so it lags the views by a few seconds.
+    view_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+@event.listens_for(BlogPost, "after_insert")
+def _create_post_stats(mapper, connection, target):
+    connection.execute(insert(PostStats.__table__).values(
+        post_id=target.id, comment_count=0, view_count=0, last_activity_at=target.created_at
+    ))
+
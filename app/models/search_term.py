@@ -0,0 +1,9 @@
+from app.database import db
+
+
+# Posting list of the fallback search engine: how much weight a term has in a post.
+class SearchTerm(db.Model):
+    __tablename__ = "search_terms"
+    term = db.Column(db.String(64), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("blog_posts.id"), primary_key=True, index=True)
+    weight = db.Column(db.Integer, nullable=False)
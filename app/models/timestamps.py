@@ -0,0 +1,6 @@
+from datetime import datetime, timezone
+
+
+def utcnow() -> datetime:
+    """The current time in UTC, naive, as the DateTime columns store it."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,158 @@
+"""
+Fingerprinted, precompressed static files.
+
+flask assets build copies every file of the static folder to ASSETS_BUILD_DIR under a name that
+contains a hash of its content, e.g. css/styles.3b1f0c9a2d4e.css, next to .gz and, when the brotli
+package is installed, .br variants, and writes manifest.json. With a manifest, url_for("static")
+links to the fingerprinted names, which are served with a far-future immutable Cache-Control and
+the best variant the client accepts, picked from the manifest, so no request compresses anything.
+Without a manifest, static files are served as Flask does.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+from typing import Dict, List, Optional
+
+from flask import Flask, current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+# Only text benefits from compression; images and fonts are compressed already.
+_COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".map", ".svg", ".json", ".txt", ".xml", ".html", ".ico"}
+# Preferred first when the client accepts both.
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _fingerprinted_name(path: str, digest: str) -> str:
+    root, extension = os.path.splitext(path)
+    return f"{root}.{digest[:12]}{extension}"
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    # mtime=0 keeps the output, and so the build, reproducible.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def build(static_dir: str, build_dir: str) -> dict:
+    """
+        Writes the fingerprinted and compressed copies of the files of static_dir to build_dir and
+        returns the manifest, which is also written to build_dir/manifest.json. Files from earlier
+        builds are kept, so pages rendered before a deploy still find their assets.
+
+        A compressed variant is only kept when it is smaller than the file.
+    """
+    static_dir, build_dir = os.path.abspath(static_dir), os.path.abspath(build_dir)
+    encodings = [(name, suffix) for name, suffix in _ENCODINGS if name != "br" or brotli is not None]
+    if brotli is None:
+        logger.warning("The brotli package is not installed, only gzip variants are built.")
+
+    files: Dict[str, str] = {}
+    variants: Dict[str, List[str]] = {}
+    for directory, subdirectories, filenames in os.walk(static_dir):
+        if os.path.abspath(directory) == build_dir or os.path.abspath(directory).startswith(build_dir + os.sep):
+            subdirectories[:] = []
+            continue
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            source = os.path.join(directory, filename)
+            logical_name = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            with open(source, "rb") as file:
+                data = file.read()
+            name = _fingerprinted_name(logical_name, hashlib.sha256(data).hexdigest())
+            target = os.path.join(build_dir, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            files[logical_name] = name
+            variants[name] = []
+            if os.path.splitext(filename)[1].lower() not in _COMPRESSIBLE_EXTENSIONS:
+                continue
+            for encoding, suffix in encodings:
+                compressed = _compress(data, encoding)
+                if len(compressed) < len(data):
+                    with open(target + suffix, "wb") as file:
+                        file.write(compressed)
+                    variants[name].append(encoding)
+
+    manifest = {"files": files, "encodings": variants}
+    with open(os.path.join(build_dir, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    logger.info("Built %s static files into %s.", len(files), build_dir)
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, build_dir: str, manifest: dict, max_age: int):
+        self.build_dir = build_dir
+        self.max_age = max_age
+        self.prefix = os.path.basename(build_dir)
+        # Logical name -> URL filename under the static folder, e.g. "dist/css/styles.3b1f0c9a2d4e.css".
+        self.urls = {logical: f"{self.prefix}/{name}" for logical, name in manifest["files"].items()}
+        self.encodings = {f"{self.prefix}/{name}": encodings for name, encodings in manifest["encodings"].items()}
+
+    def url_filename(self, filename: str) -> Optional[str]:
+        return self.urls.get(filename)
+
+    def serve(self, filename: str):
+        encodings = self.encodings.get(filename)
+        if encodings is None:
+            return None
+        name = filename[len(self.prefix) + 1:]
+        served, encoding = name, None
+        for candidate in encodings:
+            if request.accept_encodings[candidate]:
+                served, encoding = f"{name}{dict(_ENCODINGS)[candidate]}", candidate
+                break
+        # The mimetype is the one of the original file, not of the .gz or .br.
+        response = send_from_directory(self.build_dir, served, mimetype=mimetypes.guess_type(name)[0],
+                                       max_age=self.max_age, conditional=True, etag=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if encodings:
+            response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+def init_app(app: Flask):
+    """
+        Loads the manifest of ASSETS_BUILD_DIR, if flask assets build has written one, and makes
+        url_for("static") and the static route use the fingerprinted files.
+    """
+    build_dir = os.path.join(app.static_folder, app.config["ASSETS_BUILD_DIR"])
+    app.extensions["assets"] = None
+    try:
+        with open(os.path.join(build_dir, MANIFEST)) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return
+    assets = app.extensions["assets"] = AssetManifest(build_dir, manifest, app.config["ASSETS_MAX_AGE"])
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == "static":
+            values["filename"] = assets.url_filename(values["filename"]) or values["filename"]
+
+    serve_static_file = app.view_functions["static"]
+
+    def static(filename):
+        response = assets.serve(filename)
+        return response if response is not None else serve_static_file(filename=filename)
+
+    app.view_functions["static"] = static
+
+
+def get_assets() -> Optional[AssetManifest]:
+    return current_app.extensions.get("assets")
@@ -1,9 +1,122 @@
-from werkzeug.security import check_password_hash, generate_password_hash
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import Flask, current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_HASH_METHOD = "pbkdf2:sha256:600000"
+DEFAULT_SALT_LENGTH = 16
+
+
+class HashingOverloaded(Exception):
+    """Raised when too many password hashes are already running or queued."""
+
+
+def method_prefix(method: str) -> str:
+    """
+        Returns the prefix werkzeug stores in front of a hash made with method, with its defaults
+        filled in, e.g. "pbkdf2:sha256:600000" for "pbkdf2".
+    """
+    name, *args = method.split(":")
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    if name == "scrypt" and not args:
+        return f"scrypt:{2 ** 15}:8:1"
+    return method
+
+
+class PasswordHasher:
+    """
+        Runs the password hashing of the request workers in a bounded process pool.
+
+        At most workers + queue_limit hashes are in flight; beyond that HashingOverloaded is raised
+        at once instead of queueing, so a login burst cannot stall the rest of the site.
+        With workers set to 0 the hashes run inline.
+    """
+
+    def __init__(self, method: str = DEFAULT_HASH_METHOD, salt_length: int = DEFAULT_SALT_LENGTH,
+                 workers: int = 0, queue_limit: int = 0, timeout: float = 10):
+        self.method = method
+        self._method_prefix = method_prefix(method)
+        self.salt_length = salt_length
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_limit) if workers else None
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use in each process, so forked workers never share the pool of their parent.
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingOverloaded()
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Released when the hash finishes, not when this request stops waiting for it: a hash
+        # that timed out still occupies its worker.
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result(timeout=self.timeout)
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, hashed_password: str, plain_password: str) -> bool:
+        return self._run(check_password_hash, hashed_password, plain_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        method, _, rest = hashed_password.partition("$")
+        salt = rest.partition("$")[0]
+        return method != self._method_prefix or len(salt) != self.salt_length
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_default_hasher = PasswordHasher()
+
+
+def init_app(app: Flask):
+    """
+        Creates the password hasher configured by PASSWORD_HASH_* and attaches it to the app.
+    """
+    app.extensions["password_hasher"] = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        salt_length=app.config["PASSWORD_SALT_LENGTH"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        queue_limit=app.config["PASSWORD_HASH_QUEUE_LIMIT"],
+        timeout=app.config["PASSWORD_HASH_TIMEOUT"]
+    )
+
+
+def get_password_hasher() -> PasswordHasher:
+    if has_app_context():
+        return current_app.extensions.get("password_hasher", _default_hasher)
+    return _default_hasher
 
 
 def confirm_password(hashed_password: str, plain_password: str):
-    return check_password_hash(hashed_password, plain_password)
+    return get_password_hasher().verify(hashed_password, plain_password)
 
 
 def hash_user_password(password: str):
-    return generate_password_hash(password, method='pbkdf2:sha256', salt_length=16)
+    return get_password_hasher().hash(password)
+
+
+def password_needs_rehash(hashed_password: str):
+    return get_password_hasher().needs_rehash(hashed_password)
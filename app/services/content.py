@@ -0,0 +1,221 @@
+"""
+Bulk import and export of users, posts and comments as flat records.
+
+Records refer to each other by natural keys instead of ids: posts and comments name their author
+by email and comments name their post by title, so content can move between databases. Import
+users first, then posts, then comments.
+"""
+import itertools
+import logging
+from datetime import date
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from flask import current_app
+from sqlalchemy import bindparam, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from app.models import BlogPost, Comment, User
+from app.services import identity_cache, post_stats, rendering, search
+
+logger = logging.getLogger(__name__)
+
+FIELDS = {
+    "users": ["email", "name", "password", "is_admin"],
+    "posts": ["title", "subtitle", "date", "body", "img_url", "author_email"],
+    "comments": ["post_title", "author_email", "text"],
+}
+_REQUIRED = {
+    "users": ["email", "password"],
+    "posts": ["title", "subtitle", "body", "img_url", "author_email"],
+    "comments": ["post_title", "author_email", "text"],
+}
+
+
+class ImportProgress(NamedTuple):
+    read: int
+    inserted: int
+    updated: int
+    skipped: int
+
+
+def _export_statement(kind: str):
+    if kind == "users":
+        return select(User.email, User.name, User.password, User.is_admin).order_by(User.id)
+    if kind == "posts":
+        return (
+            select(BlogPost.title, BlogPost.subtitle, BlogPost.date, BlogPost.body, BlogPost.img_url,
+                   User.email.label("author_email"))
+            .outerjoin(User, BlogPost.author_id == User.id)
+            .order_by(BlogPost.id)
+        )
+    return (
+        select(BlogPost.title.label("post_title"), User.email.label("author_email"), Comment.text)
+        .join(BlogPost, Comment.post_id == BlogPost.id)
+        .outerjoin(User, Comment.author_id == User.id)
+        .order_by(Comment.id)
+    )
+
+
+def export_records(session: Session, kind: str, batch_size: int = 1000) -> Iterable[dict]:
+    """
+        Yields every record of kind ("users", "posts" or "comments") with the FIELDS of that kind.
+        Rows are streamed batch_size at a time, with a server-side cursor where the driver has one,
+        so memory use does not grow with the table.
+    """
+    rows = session.execute(_export_statement(kind).execution_options(yield_per=batch_size))
+    for row in rows:
+        yield dict(row._mapping)
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def _emails_to_ids(session: Session, emails: Iterable[str]) -> Dict[str, int]:
+    return dict(session.execute(select(User.email, User.id).where(User.email.in_(set(emails)))).all())
+
+
+def _import_users(session: Session, records: List[dict], on_duplicate: str) -> Tuple[int, int]:
+    rows = {
+        record["email"]: {
+            "email": record["email"],
+            "name": record.get("name") or "",
+            "password": record["password"],
+            "is_admin": _as_bool(record.get("is_admin", False)),
+        }
+        for record in records
+    }
+    existing = set(_emails_to_ids(session, rows))
+    new_rows = [row for email, row in rows.items() if email not in existing]
+    if new_rows:
+        session.execute(insert(User), new_rows)
+    if on_duplicate != "merge" or not existing:
+        return len(new_rows), 0
+    users = User.__table__
+    session.execute(
+        update(users).where(users.c.email == bindparam("match_email"))
+        .values(name=bindparam("name"), password=bindparam("password"), is_admin=bindparam("is_admin")),
+        [dict(row, match_email=email) for email, row in rows.items() if email in existing]
+    )
+    return len(new_rows), len(existing)
+
+
+def _import_posts(session: Session, records: List[dict], on_duplicate: str) -> Tuple[int, int]:
+    author_ids = _emails_to_ids(session, (record["author_email"] for record in records))
+    excerpt_length = current_app.config["POST_EXCERPT_LENGTH"]
+    rows = {}
+    for record in records:
+        author_id = author_ids.get(record["author_email"])
+        if author_id is None:
+            logger.warning("Skipped post %r: no user with email %s.", record["title"], record["author_email"])
+            continue
+        rows[record["title"]] = {
+            "title": record["title"],
+            "subtitle": record["subtitle"],
+            "date": record.get("date") or date.today().strftime("%B %d, %Y"),
+            "body": record["body"],
+            **rendering.compile_post(record["body"], excerpt_length)._asdict(),
+            "img_url": record["img_url"],
+            "author_id": author_id,
+        }
+    existing = dict(session.execute(select(BlogPost.title, BlogPost.id).where(BlogPost.title.in_(rows))).all())
+    new_rows = [row for title, row in rows.items() if title not in existing]
+    if new_rows:
+        session.execute(insert(BlogPost), new_rows)
+    merged = existing if on_duplicate == "merge" else {}
+    if merged:
+        posts = BlogPost.__table__
+        session.execute(
+            update(posts).where(posts.c.id == bindparam("post_id"))
+            .values(subtitle=bindparam("subtitle"), date=bindparam("date"), body=bindparam("body"),
+                    body_html=bindparam("body_html"), excerpt=bindparam("excerpt"), img_url=bindparam("img_url"),
+                    author_id=bindparam("author_id")),
+            [dict(rows[title], post_id=post_id) for title, post_id in merged.items()]
+        )
+
+    engine = search.get_search_engine()
+    for post_id in merged.values():
+        engine.remove_post(session, post_id)
+    changed_titles = [row["title"] for row in new_rows] + list(merged)
+    if changed_titles:
+        engine.index_posts(session, [dict(row._mapping) for row in session.execute(
+            select(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.body)
+            .where(BlogPost.title.in_(changed_titles))
+        )])
+    if new_rows:
+        # The bulk insert bypasses the ORM events that create the stats rows.
+        post_stats.recompute(session, session.execute(
+            select(BlogPost.id).where(BlogPost.title.in_([row["title"] for row in new_rows]))
+        ).scalars().all())
+    return len(new_rows), len(merged)
+
+
+def _import_comments(session: Session, records: List[dict], on_duplicate: str) -> Tuple[int, int]:
+    # A duplicate comment has the same text, so merging it changes nothing: both modes skip it.
+    author_ids = _emails_to_ids(session, (record["author_email"] for record in records))
+    post_ids = dict(session.execute(
+        select(BlogPost.title, BlogPost.id).where(BlogPost.title.in_({record["post_title"] for record in records}))
+    ).all())
+    rows = {}
+    for record in records:
+        post_id, author_id = post_ids.get(record["post_title"]), author_ids.get(record["author_email"])
+        if post_id is None or author_id is None:
+            logger.warning("Skipped comment on %r by %s: unknown post or author.",
+                           record["post_title"], record["author_email"])
+            continue
+        text_hash = Comment.hash_text(record["text"])
+        rows[(post_id, author_id, text_hash)] = {
+            "post_id": post_id, "author_id": author_id, "text": record["text"], "text_hash": text_hash,
+            "text_html": rendering.compile_comment(record["text"])
+        }
+    existing = {tuple(row) for row in session.execute(
+        select(Comment.post_id, Comment.author_id, Comment.text_hash)
+        .where(tuple_(Comment.post_id, Comment.author_id, Comment.text_hash).in_(list(rows)))
+    )} if rows else set()
+    new_rows = [row for key, row in rows.items() if key not in existing]
+    if new_rows:
+        session.execute(insert(Comment), new_rows)
+        post_stats.recompute(session, list({row["post_id"] for row in new_rows}))
+    return len(new_rows), 0
+
+
+_IMPORTERS: Dict[str, Callable[[Session, List[dict], str], Tuple[int, int]]] = {
+    "users": _import_users,
+    "posts": _import_posts,
+    "comments": _import_comments,
+}
+
+
+def import_records(session: Session, kind: str, records: Iterable[dict], batch_size: int = 1000,
+                   on_duplicate: str = "skip") -> Iterable[ImportProgress]:
+    """
+        Inserts records of kind in chunks of batch_size rows, one executemany and one commit per
+        chunk, and yields the running totals after each chunk.
+
+        Authors and posts are resolved from author_email and post_title; records naming an unknown
+        one are skipped. Users matching an existing email and posts matching an existing title are
+        skipped, or updated in place when on_duplicate is "merge", which drops the cached identities
+        of this process. Imported posts are indexed for
+        search, and the stats of the posts gaining posts or comments are recomputed.
+
+        Raises:
+        - ValueError: If a record lacks a required field. Earlier chunks stay committed.
+    """
+    read = inserted = updated = 0
+    records = iter(records)
+    while chunk := list(itertools.islice(records, batch_size)):
+        for number, record in enumerate(chunk, start=read + 1):
+            missing = [field for field in _REQUIRED[kind] if not record.get(field)]
+            if missing:
+                raise ValueError(f"Record {number} has no {', '.join(missing)}.")
+        chunk_inserted, chunk_updated = _IMPORTERS[kind](session, chunk, on_duplicate)
+        session.commit()
+        if kind == "users" and chunk_updated:
+            # Merged users may be logged in with their old name or admin flag cached.
+            identity_cache.invalidate_all()
+        read += len(chunk)
+        inserted += chunk_inserted
+        updated += chunk_updated
+        yield ImportProgress(read=read, inserted=inserted, updated=updated, skipped=read - inserted - updated)
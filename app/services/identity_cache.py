@@ -0,0 +1,101 @@
+import threading
+from typing import Optional
+
+from flask import Flask, current_app, g
+from flask_login import UserMixin
+
+from app.database import db
+from app.models import User
+from app.services.page_cache import MemoryCacheBackend
+
+
+class CachedUser(UserMixin):
+    """
+        The logged in user as the login manager sees it: only the fields the views and templates
+        read, detached from the database session.
+    """
+
+    def __init__(self, id: int, name: str, email: str, is_admin: bool):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.is_admin = is_admin
+
+    def __repr__(self):
+        return f"<CachedUser {self.id}>"
+
+
+class IdentityCache:
+    """
+        Bounded LRU with a TTL of the identities loaded by the login manager, per process.
+        crud_user invalidates an identity when its row changes; other processes pick the change up
+        within the TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._backend = MemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self, user_id: int) -> Optional[CachedUser]:
+        identity = self._backend.get(user_id)
+        g.identity_cache_hit = identity is not None
+        with self._lock:
+            if identity is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if identity is not None:
+            return identity
+
+        row = db.session.execute(
+            db.select(User.id, User.name, User.email, User.is_admin).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        identity = CachedUser(id=row.id, name=row.name, email=row.email, is_admin=row.is_admin)
+        self._backend.set(user_id, identity)
+        return identity
+
+    def invalidate(self, user_id: int):
+        self._backend.delete(user_id)
+
+    def clear(self):
+        self._backend.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._backend)}
+
+
+def init_app(app: Flask):
+    """
+        Creates the identity cache configured by IDENTITY_CACHE_* and attaches it to the app.
+    """
+    app.extensions["identity_cache"] = IdentityCache(
+        max_entries=app.config["IDENTITY_CACHE_MAX_ENTRIES"],
+        ttl=app.config["IDENTITY_CACHE_TTL"]
+    )
+
+
+def get_identity_cache() -> IdentityCache:
+    return current_app.extensions["identity_cache"]
+
+
+def load_user(user_id: str) -> Optional[CachedUser]:
+    return get_identity_cache().load(int(user_id))
+
+
+def invalidate_user(user_id: int):
+    cache = current_app.extensions.get("identity_cache")
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+def invalidate_all():
+    """
+        Drops every cached identity, e.g. after a bulk update of the users.
+    """
+    cache = current_app.extensions.get("identity_cache")
+    if cache is not None:
+        cache.clear()
@@ -0,0 +1,403 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from flask import Flask, Response, current_app, g, request
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+
+class MemoryCacheBackend:
+    """
+        In-process LRU cache with a TTL, and tags that group keys for invalidation.
+        Each worker process holds its own copy.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, _ = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, tags: Iterable[str] = ()):
+        tags = frozenset(tags)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteCacheBackend:
+    """
+        LRU cache with a TTL stored in a SQLite file, so that every worker process on the host
+        shares the same entries and sees the same invalidations.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed_at ON cache_entries (accessed_at);
+                CREATE TABLE IF NOT EXISTS cache_tags (
+                    tag TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    PRIMARY KEY (tag, key)
+                );
+                CREATE INDEX IF NOT EXISTS ix_cache_tags_key ON cache_tags (key);
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            self.delete(key)
+            return None
+        connection.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, value: bytes, tags: Iterable[str] = ()):
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM cache_tags WHERE key = ?", (key,))
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now)
+            )
+            connection.executemany("INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)",
+                                   [(tag, key) for tag in set(tags)])
+            overflow = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                evicted = connection.execute(
+                    "SELECT key FROM cache_entries ORDER BY accessed_at LIMIT ?", (overflow,)
+                ).fetchall()
+                self._delete_keys(connection, [row[0] for row in evicted])
+
+    def delete(self, key: str):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            self._delete_keys(connection, [key])
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for tag in set(tags):
+                keys = connection.execute("SELECT key FROM cache_tags WHERE tag = ?", (tag,)).fetchall()
+                self._delete_keys(connection, [row[0] for row in keys])
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM cache_entries")
+            connection.execute("DELETE FROM cache_tags")
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    @staticmethod
+    def _delete_keys(connection: sqlite3.Connection, keys: list):
+        connection.executemany("DELETE FROM cache_entries WHERE key = ?", [(key,) for key in keys])
+        connection.executemany("DELETE FROM cache_tags WHERE key = ?", [(key,) for key in keys])
+
+
+class PageCache:
+    """
+        Caches rendered pages for anonymous visitors on top of a pluggable backend and counts
+        hits and misses of this process.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes, tags: Iterable[str] = ()):
+        self.backend.set(key, value, tags)
+
+    def invalidate_tags(self, tags: Iterable[str]):
+        self.backend.invalidate_tags(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.backend)}
+
+
+def init_app(app: Flask):
+    """
+        Creates the page cache configured by PAGE_CACHE_* and attaches it to the app.
+    """
+    if not app.config.get("PAGE_CACHE_ENABLED"):
+        app.extensions["page_cache"] = None
+        return
+
+    max_entries = app.config["PAGE_CACHE_MAX_ENTRIES"]
+    ttl = app.config["PAGE_CACHE_TTL"]
+    backend_name = app.config["PAGE_CACHE_BACKEND"]
+    if backend_name == "memory":
+        backend = MemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+    elif backend_name == "sqlite":
+        backend = SQLiteCacheBackend(path=app.config["PAGE_CACHE_PATH"], max_entries=max_entries, ttl=ttl)
+    else:
+        raise ValueError(f"Unknown PAGE_CACHE_BACKEND: {backend_name}")
+    app.extensions["page_cache"] = PageCache(backend)
+
+
+def get_page_cache() -> Optional[PageCache]:
+    return current_app.extensions.get("page_cache")
+
+
+def add_tags(*tags: str):
+    """
+        Adds invalidation tags to the page being rendered by the current request.
+    """
+    g.setdefault("page_cache_tags", set()).update(tags)
+
+
+def _cache_when_sent(cache: PageCache, key: str, chunks: Iterable, tags: set) -> Iterable[bytes]:
+    # A streamed page is stored once it has been sent in full; a client gone midway stores nothing.
+    body = []
+    for chunk in chunks:
+        chunk = chunk.encode() if isinstance(chunk, str) else chunk
+        body.append(chunk)
+        yield chunk
+    cache.set(key, b"".join(body), tags)
+
+
+def cached_page(make_key: Callable[..., str], mimetype: str = "text/html"):
+    """
+        Serves GET requests of anonymous visitors from the page cache.
+
+        make_key receives the view arguments and returns the cache key of the page. Views add
+        the tags the page depends on with add_tags, so writes can drop exactly those pages.
+        Cached bodies are served as mimetype, which must be the one of the view's responses.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            cache = get_page_cache()
+            if cache is None or request.method != "GET" or current_user.is_authenticated:
+                return f(*args, **kwargs)
+
+            key = make_key(**kwargs)
+            body = cache.get(key)
+            if body is not None:
+                response = Response(body, mimetype=mimetype)
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            g.page_cache_tags = set()
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                if response.is_streamed:
+                    response.response = _cache_when_sent(cache, key, response.response, g.page_cache_tags)
+                else:
+                    cache.set(key, response.get_data(), g.page_cache_tags)
+            response.headers["X-Cache"] = "MISS"
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def _cached_last_modified(get_last_modified: Callable[..., Optional[datetime]], make_key: Optional[Callable[..., str]],
+                          make_tags: Callable[..., Iterable[str]], kwargs: dict) -> Optional[datetime]:
+    cache = get_page_cache()
+    if cache is None or make_key is None:
+        return get_last_modified(**kwargs)
+    # Read from the backend, so the validators do not count as page hits and misses.
+    key = f"last-modified:{make_key(**kwargs)}"
+    value = cache.backend.get(key)
+    if value is not None:
+        return datetime.fromisoformat(value.decode())
+    last_modified = get_last_modified(**kwargs)
+    if last_modified is not None:
+        cache.set(key, last_modified.isoformat().encode(), make_tags(**kwargs))
+    return last_modified
+
+
+def conditional_page(get_last_modified: Callable[..., Optional[datetime]],
+                     make_key: Optional[Callable[..., str]] = None,
+                     make_tags: Callable[..., Iterable[str]] = lambda **kwargs: ()):
+    """
+        Answers GET requests with 304 Not Modified when the page has not changed since the copy
+        the client holds, and adds ETag and Last-Modified to the full responses.
+
+        get_last_modified receives the view arguments and returns when the page last changed (UTC),
+        or None to let the view handle the request, e.g. with a 404. With make_key, the result is
+        kept in the page cache next to the page, under the tags returned by make_tags, so requests
+        need no query until those tags are invalidated. The ETag also covers the visitor, since
+        logged in users see a different page. Apply it above cached_page, so cache hits carry the
+        validators too.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return f(*args, **kwargs)
+            last_modified = _cached_last_modified(get_last_modified, make_key, make_tags, kwargs)
+            if last_modified is None:
+                return f(*args, **kwargs)
+
+            etag = hashlib.sha1(
+                f"{request.path}|{last_modified.isoformat()}|{current_user.get_id()}".encode()
+            ).hexdigest()
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            else:
+                response = Response(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.vary.add("Cookie")
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def index_key(**kwargs) -> str:
+    return (f"index?before={request.args.get('before', '')}&after={request.args.get('after', '')}"
+            f"&sort={request.args.get('sort', '')}&cursor={request.args.get('cursor', '')}")
+
+
+def post_key(post_id: int, **kwargs) -> str:
+    return f"post:{post_id}"
+
+
+def comments_key(post_id: int, **kwargs) -> str:
+    return f"comments:{post_id}?order={request.args.get('order', '')}&after={request.args.get('after', '')}"
+
+
+def _invalidate(*tags: str):
+    cache = get_page_cache()
+    if cache is not None:
+        cache.invalidate_tags(tags)
+
+
+def invalidate_index_head():
+    """
+        Drops the index pages a new post shows up on: the first page and the pages of newer posts.
+    """
+    _invalidate("index:head")
+
+
+def invalidate_post(post_id: int):
+    """
+        Drops the page of a post and every index page listing it.
+    """
+    _invalidate(f"post:{post_id}", f"listing:{post_id}")
+
+
+def invalidate_activity():
+    """
+        Drops the index pages sorted by activity, whose order changes with every comment.
+    """
+    _invalidate("index:activity")
+
+
+def invalidate_most_viewed():
+    """
+        Drops the index page of the most viewed posts, after new views are written.
+    """
+    _invalidate("index:views")
+
+
+def invalidate_all():
+    """
+        Drops every cached page, e.g. after a bulk import.
+    """
+    cache = get_page_cache()
+    if cache is not None:
+        cache.clear()
@@ -0,0 +1,154 @@
+"""
+Deletion of posts and their comments with set-based DELETE statements.
+
+The comments of a post are deleted batch_size at a time, each batch in its own transaction, so
+deleting a post with many comments neither loads them into the session nor holds one long write
+lock. The post, its stats row and its search entry go last, in one transaction, so a deletion
+that is interrupted leaves the post in place and can simply be run again. Posts with at least
+POST_DELETE_BACKGROUND_THRESHOLD comments are deleted by a background thread instead of the request.
+"""
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, NamedTuple, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.models import BlogPost, Comment, PostStats
+from app.services import page_cache, search, syndication
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionProgress(NamedTuple):
+    deleted: int
+
+
+def delete_comments(session: Session, post_id: int, batch_size: int = 1000) -> Iterable[DeletionProgress]:
+    """
+        Deletes the comments of the post, batch_size at a time in id order, committing after each
+        batch. Yields the running total after each batch.
+    """
+    deleted = 0
+    while True:
+        comment_ids = session.execute(
+            select(Comment.id).where(Comment.post_id == post_id).order_by(Comment.id).limit(batch_size)
+        ).scalars().all()
+        if not comment_ids:
+            break
+        deleted += session.execute(
+            delete(Comment).where(Comment.id.in_(comment_ids)).execution_options(synchronize_session=False)
+        ).rowcount
+        session.commit()
+        yield DeletionProgress(deleted=deleted)
+
+
+def delete_post(session: Session, post_id: int, batch_size: int = 1000) -> int:
+    """
+        Deletes the post with its comments, stats row and search entry, and drops the pages and
+        feeds that show it.
+
+        Returns:
+        - int: The number of comments deleted.
+    """
+    progress = DeletionProgress(deleted=0)
+    for progress in delete_comments(session, post_id, batch_size=batch_size):
+        logger.debug("Deleted %s comments of post %s.", progress.deleted, post_id)
+    # Comments written since the last batch are few, they go with the post.
+    deleted = progress.deleted + session.execute(
+        delete(Comment).where(Comment.post_id == post_id).execution_options(synchronize_session=False)
+    ).rowcount
+    search.get_search_engine().remove_post(session, post_id)
+    session.execute(delete(PostStats).where(PostStats.post_id == post_id).execution_options(synchronize_session=False))
+    session.execute(delete(BlogPost).where(BlogPost.id == post_id).execution_options(synchronize_session=False))
+    session.commit()
+    page_cache.invalidate_post(post_id)
+    syndication.invalidate_post(post_id, listing_changed=True)
+    logger.info("Deleted post %s and its %s comments.", post_id, deleted)
+    return deleted
+
+
+def purge_orphan_comments(session: Session, batch_size: int = 1000) -> Iterable[DeletionProgress]:
+    """
+        Deletes the comments without a post, i.e. whose post_id is empty or names a deleted post,
+        scanning the comments in id order and deleting up to batch_size of them per transaction.
+        Yields the running total after each batch.
+    """
+    deleted = 0
+    last_id = 0
+    while True:
+        comment_ids = session.execute(
+            select(Comment.id).outerjoin(BlogPost, BlogPost.id == Comment.post_id)
+            .where(Comment.id > last_id, BlogPost.id.is_(None))
+            .order_by(Comment.id).limit(batch_size)
+        ).scalars().all()
+        if not comment_ids:
+            break
+        deleted += session.execute(
+            delete(Comment).where(Comment.id.in_(comment_ids)).execution_options(synchronize_session=False)
+        ).rowcount
+        session.commit()
+        last_id = comment_ids[-1]
+        yield DeletionProgress(deleted=deleted)
+
+
+class PostDeleter:
+    """
+        Runs post deletions one at a time on a background thread. Deletions still queued when the
+        process exits normally are finished first; a killed worker leaves the post in place.
+    """
+
+    def __init__(self, app: Flask, batch_size: int):
+        self.app = app
+        self.batch_size = batch_size
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created on first use in each process, so forked workers never share the thread of their parent.
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                if self._executor_pid is None:
+                    atexit.register(self.shutdown)
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="post-deletion")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _delete(self, post_id: int) -> int:
+        with self.app.app_context():
+            try:
+                return delete_post(db.session, post_id, batch_size=self.batch_size)
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Error deleting post %s in the background: %s", post_id, e)
+                raise
+
+    def submit(self, post_id: int) -> Future:
+        return self._get_executor().submit(self._delete, post_id)
+
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def init_app(app: Flask):
+    """
+        Creates the background post deleter configured by POST_DELETE_* and attaches it to the app.
+    """
+    app.extensions["post_deleter"] = PostDeleter(app, batch_size=app.config["POST_DELETE_BATCH_SIZE"])
+
+
+def get_post_deleter() -> PostDeleter:
+    return current_app.extensions["post_deleter"]
+
+
+def runs_in_background(comment_count: Optional[int]) -> bool:
+    threshold = current_app.config["POST_DELETE_BACKGROUND_THRESHOLD"]
+    return bool(threshold) and (comment_count or 0) >= threshold
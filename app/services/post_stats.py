@@ -0,0 +1,114 @@
+"""
+Maintenance of the post_stats rows: the comment count and activity times of every post.
+
+Writes keep the rows current in their own transaction; recompute and reconcile rebuild them from
+the comments, for bulk imports and to repair drift.
+"""
+import logging
+from datetime import datetime
+from typing import Iterable, List, NamedTuple
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models import BlogPost, Comment, PostStats
+
+logger = logging.getLogger(__name__)
+
+
+class ReconcileProgress(NamedTuple):
+    checked: int
+    repaired: int
+
+
+def record_comment(session: Session, post_id: int, created_at: datetime):
+    """
+        Counts a new comment of the post, in the transaction of the session. The increment runs
+        in the database, so concurrent comments are not lost. A post without a stats row, e.g.
+        one imported before the row existed, gets it recomputed instead.
+    """
+    counted = session.execute(
+        update(PostStats).where(PostStats.post_id == post_id)
+        .values(comment_count=PostStats.comment_count + 1, last_comment_at=created_at, last_activity_at=created_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not counted:
+        recompute(session, [post_id])
+
+
+def recompute(session: Session, post_ids: List[int]) -> int:
+    """
+        Recomputes the stats of the given posts from their comments with one grouped query, and
+        writes the rows that are missing or differ. view_count is kept.
+
+        Returns:
+        - int: The number of rows inserted or updated.
+    """
+    if not post_ids:
+        return 0
+    actual = session.execute(
+        select(BlogPost.id, BlogPost.created_at, func.count(Comment.id).label("comment_count"),
+               func.max(Comment.created_at).label("last_comment_at"))
+        .outerjoin(Comment, Comment.post_id == BlogPost.id)
+        .where(BlogPost.id.in_(post_ids))
+        .group_by(BlogPost.id, BlogPost.created_at)
+    ).all()
+    stored = {row.post_id: row for row in session.execute(
+        select(PostStats.post_id, PostStats.comment_count, PostStats.last_comment_at, PostStats.last_activity_at)
+        .where(PostStats.post_id.in_(post_ids))
+    )}
+
+    missing, drifted = [], []
+    for row in actual:
+        expected = {
+            "comment_count": row.comment_count,
+            "last_comment_at": row.last_comment_at,
+            "last_activity_at": max(filter(None, (row.created_at, row.last_comment_at))),
+        }
+        current = stored.get(row.id)
+        if current is None:
+            missing.append(dict(expected, post_id=row.id, view_count=0))
+        elif any(getattr(current, column) != value for column, value in expected.items()):
+            drifted.append(dict(expected, match_post_id=row.id))
+
+    if missing:
+        session.execute(insert(PostStats), missing)
+    if drifted:
+        stats = PostStats.__table__
+        session.execute(
+            update(stats).where(stats.c.post_id == bindparam("match_post_id"))
+            .values(comment_count=bindparam("comment_count"), last_comment_at=bindparam("last_comment_at"),
+                    last_activity_at=bindparam("last_activity_at")),
+            drifted
+        )
+    return len(missing) + len(drifted)
+
+
+def reconcile(session: Session, batch_size: int = 1000) -> Iterable[ReconcileProgress]:
+    """
+        Recomputes the stats of every post, batch_size posts at a time in post id order, committing
+        after each batch, then deletes the rows of posts that no longer exist. Yields the running
+        totals after each batch.
+    """
+    checked = repaired = 0
+    last_id = 0
+    while True:
+        post_ids = session.execute(
+            select(BlogPost.id).where(BlogPost.id > last_id).order_by(BlogPost.id).limit(batch_size)
+        ).scalars().all()
+        if not post_ids:
+            break
+        repaired += recompute(session, post_ids)
+        session.commit()
+        checked += len(post_ids)
+        last_id = post_ids[-1]
+        yield ReconcileProgress(checked=checked, repaired=repaired)
+
+    orphans = session.execute(
+        delete(PostStats).where(PostStats.post_id.not_in(select(BlogPost.id)))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    session.commit()
+    if orphans:
+        logger.info("Deleted the stats of %s deleted posts.", orphans)
+    yield ReconcileProgress(checked=checked, repaired=repaired + orphans)
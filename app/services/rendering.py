@@ -0,0 +1,217 @@
+"""
+Compiles the HTML written in CKEditor into the HTML the pages render, once, when it is saved.
+
+Posts and comments keep their source as written, for editing, next to the compiled fragments:
+blog_posts.body_html and blog_posts.excerpt, and comments.text_html. Compiling sanitizes the
+HTML against an allowlist of tags, attributes and URL schemes, marks external links nofollow and
+makes images load lazily. Rows saved before a change to the pipeline are recompiled with
+flask content compile.
+"""
+from html.parser import HTMLParser
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+from flask import Flask, current_app
+from markupsafe import Markup, escape
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from app.models import BlogPost, Comment
+
+_ALLOWED_ATTRIBUTES = {
+    "a": {"href", "title"},
+    "abbr": {"title"},
+    "b": set(), "blockquote": set(), "br": set(), "caption": set(), "code": set(), "del": set(), "div": set(),
+    "em": set(), "figcaption": set(), "figure": set(), "h1": set(), "h2": set(), "h3": set(), "h4": set(),
+    "h5": set(), "h6": set(), "hr": set(), "i": set(), "li": set(), "ol": set(), "p": set(), "pre": set(),
+    "s": set(), "span": set(), "strong": set(), "sub": set(), "sup": set(), "table": set(), "tbody": set(),
+    "thead": set(), "tfoot": set(), "tr": set(), "u": set(), "ul": set(),
+    "img": {"src", "alt", "title", "width", "height"},
+    "td": {"colspan", "rowspan"},
+    "th": {"colspan", "rowspan", "scope"},
+}
+_VOID_TAGS = {"br", "hr", "img"}
+# Dropped with everything inside them, not only the tags.
+_DROPPED_TAGS = {"script", "style", "iframe", "object", "embed", "noscript", "template", "textarea", "select"}
+# Tags that separate words in the excerpt.
+_BLOCK_TAGS = {"blockquote", "br", "caption", "div", "figcaption", "figure", "h1", "h2", "h3", "h4", "h5", "h6",
+               "hr", "li", "p", "pre", "td", "th", "tr"}
+_URL_ATTRIBUTES = {"href", "src"}
+_URL_SCHEMES = {"", "http", "https", "mailto"}
+
+
+class CompiledPost(NamedTuple):
+    body_html: str
+    excerpt: str
+
+
+def _safe_url(value: str) -> Optional[str]:
+    # Browsers ignore whitespace and control characters inside a scheme, e.g. "java\nscript:".
+    stripped = "".join(character for character in value if character.isprintable() and not character.isspace())
+    try:
+        scheme = urlsplit(stripped).scheme.lower()
+    except ValueError:
+        return None
+    return value.strip() if scheme in _URL_SCHEMES else None
+
+
+class _Compiler(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html: List[str] = []
+        self.text: List[str] = []
+        self._open: List[str] = []
+        self._dropping = 0
+
+    def _start(self, tag: str, attrs) -> bool:
+        # Returns whether the tag was opened and needs closing.
+        if self._dropping:
+            return False
+        if tag in _BLOCK_TAGS:
+            self.text.append(" ")
+        if tag not in _ALLOWED_ATTRIBUTES:
+            return False
+
+        kept = []
+        for name, value in attrs:
+            if name not in _ALLOWED_ATTRIBUTES[tag] or value is None:
+                continue
+            if name in _URL_ATTRIBUTES:
+                value = _safe_url(value)
+                if value is None:
+                    continue
+            kept.append((name, value))
+        if tag == "a" and any(name == "href" and urlsplit(value).scheme in ("http", "https") for name, value in kept):
+            kept.append(("rel", "nofollow noopener noreferrer"))
+        elif tag == "img":
+            kept += [("loading", "lazy"), ("decoding", "async")]
+
+        self.html.append(f"<{tag}" + "".join(f' {name}="{escape(value)}"' for name, value in kept) + ">")
+        if tag in _VOID_TAGS:
+            return False
+        self._open.append(tag)
+        return True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _DROPPED_TAGS:
+            self._dropping += 1
+        else:
+            self._start(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in _DROPPED_TAGS and self._start(tag, attrs):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _DROPPED_TAGS:
+            self._dropping = max(self._dropping - 1, 0)
+            return
+        if self._dropping:
+            return
+        if tag in _BLOCK_TAGS:
+            self.text.append(" ")
+        if tag not in self._open:
+            return
+        # Close the tags left open inside this one, so the fragment stays well formed.
+        while self._open:
+            open_tag = self._open.pop()
+            self.html.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self._dropping:
+            self.html.append(str(escape(data)))
+            self.text.append(data)
+
+    def compile(self, source: str) -> Tuple[str, str]:
+        self.feed(source or "")
+        self.close()
+        self.html.extend(f"</{tag}>" for tag in reversed(self._open))
+        return "".join(self.html), " ".join("".join(self.text).split())
+
+
+def sanitize_html(source: str) -> str:
+    """
+        Returns the source HTML restricted to the allowed tags, attributes and URL schemes, with
+        external links marked nofollow and images loaded lazily.
+    """
+    return _Compiler().compile(source)[0]
+
+
+def make_excerpt(text: str, length: int) -> str:
+    """
+        Cuts text to at most length characters, at a word boundary, with an ellipsis if anything was cut.
+    """
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip(" ,.;:") + "…"
+
+
+def compile_post(body: str, excerpt_length: Optional[int] = None) -> CompiledPost:
+    """
+        Compiles a post body into its render-ready HTML and a plain-text excerpt of
+        POST_EXCERPT_LENGTH characters, in one pass over the HTML.
+    """
+    if excerpt_length is None:
+        excerpt_length = current_app.config["POST_EXCERPT_LENGTH"]
+    body_html, text = _Compiler().compile(body)
+    return CompiledPost(body_html=body_html, excerpt=make_excerpt(text, excerpt_length))
+
+
+def compile_comment(text: str) -> str:
+    return sanitize_html(text)
+
+
+def _compile_rows(session: Session, model, source_column, target_column, batch_size: int, recompile_all: bool,
+                  compile_row) -> Iterable[int]:
+    table = model.__table__
+    compiled = 0
+    last_id = 0
+    while True:
+        query = select(model.id, source_column).where(model.id > last_id).order_by(model.id).limit(batch_size)
+        if not recompile_all:
+            query = query.where(target_column.is_(None))
+        rows = session.execute(query).all()
+        if not rows:
+            break
+        # Set to themselves, so the derived columns are filled in without counting as a change of
+        # the row, e.g. of BlogPost.updated_at, which drives the caching of the post pages.
+        unchanged = {column.name: column for column in table.c if column.onupdate is not None}
+        session.execute(
+            update(table).where(table.c.id == bindparam("match_id")).values(unchanged),
+            [dict(compile_row(row[1]), match_id=row[0]) for row in rows]
+        )
+        session.commit()
+        compiled += len(rows)
+        last_id = rows[-1][0]
+        yield compiled
+
+
+def compile_posts(session: Session, batch_size: int = 500, recompile_all: bool = False) -> Iterable[int]:
+    """
+        Compiles the posts without body_html, or all of them with recompile_all, batch_size posts per
+        statement and commit. Yields the number of posts compiled so far after each batch.
+    """
+    excerpt_length = current_app.config["POST_EXCERPT_LENGTH"]
+    return _compile_rows(session, BlogPost, BlogPost.body, BlogPost.body_html, batch_size, recompile_all,
+                         lambda body: compile_post(body, excerpt_length)._asdict())
+
+
+def compile_comments(session: Session, batch_size: int = 500, recompile_all: bool = False) -> Iterable[int]:
+    """
+        Compiles the comments without text_html, or all of them with recompile_all, like compile_posts.
+    """
+    return _compile_rows(session, Comment, Comment.text, Comment.text_html, batch_size, recompile_all,
+                         lambda text: {"text_html": compile_comment(text)})
+
+
+def init_app(app: Flask):
+    """
+        Registers the compile_html template filter, which renders rows saved before their compiled
+        HTML existed, until flask content compile has run.
+    """
+    app.jinja_env.filters["compile_html"] = lambda source: Markup(sanitize_html(source))
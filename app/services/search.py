@@ -0,0 +1,226 @@
+import math
+import re
+from collections import Counter
+from html.parser import HTMLParser
+from typing import Iterable, List, NamedTuple
+
+from flask import Flask, current_app
+from markupsafe import Markup, escape
+from sqlalchemy import case, delete, event, func, insert, text
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.models import BlogPost, SearchTerm
+
+# Markers put around matched terms in snippets, replaced by <mark> once the snippet is escaped.
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+_TITLE_WEIGHT = 10
+_SUBTITLE_WEIGHT = 5
+_BODY_WEIGHT = 1
+
+
+class SearchHit(NamedTuple):
+    post_id: int
+    snippet: Markup
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+def strip_html(html: str) -> str:
+    """
+        Returns the text content of an HTML fragment with whitespace collapsed.
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html or "")
+    extractor.close()
+    return " ".join(" ".join(extractor.parts).split())
+
+
+def tokenize(value: str) -> List[str]:
+    return [token for token in _TOKEN_PATTERN.findall(value.lower()) if len(token) <= 64]
+
+
+def _render_snippet(snippet: str) -> Markup:
+    return Markup(str(escape(snippet)).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>"))
+
+
+def make_snippet(body_text: str, terms: Iterable[str], width: int = 24) -> Markup:
+    """
+        Cuts a window of about width words around the first matched term and highlights the matches.
+    """
+    terms = set(terms)
+    words = body_text.split()
+    first_match = next((i for i, word in enumerate(words) if set(tokenize(word)) & terms), 0)
+    start = max(first_match - width // 3, 0)
+    window = words[start:start + width]
+    highlighted = [f"{_MATCH_START}{word}{_MATCH_END}" if set(tokenize(word)) & terms else word for word in window]
+    snippet = " ".join(highlighted)
+    if start > 0:
+        snippet = "…" + snippet
+    if start + width < len(words):
+        snippet += "…"
+    return _render_snippet(snippet)
+
+
+class SQLiteFTSEngine:
+    """
+        Search backed by an SQLite FTS5 table whose rowid is the post id, ranked with bm25.
+    """
+    name = "fts5"
+
+    def index_post(self, session: Session, post_id: int, title: str, subtitle: str, body: str):
+        self.remove_post(session, post_id)
+        session.execute(
+            text("INSERT INTO post_search (rowid, title, subtitle, body) VALUES (:id, :title, :subtitle, :body)"),
+            {"id": post_id, "title": title, "subtitle": subtitle, "body": strip_html(body)}
+        )
+
+    def index_posts(self, session: Session, posts: List[dict]):
+        session.execute(
+            text("INSERT INTO post_search (rowid, title, subtitle, body) VALUES (:id, :title, :subtitle, :body)"),
+            [dict(post, body=strip_html(post["body"])) for post in posts]
+        )
+
+    def remove_post(self, session: Session, post_id: int):
+        session.execute(text("DELETE FROM post_search WHERE rowid = :id"), {"id": post_id})
+
+    def clear(self, session: Session):
+        session.execute(text("DELETE FROM post_search"))
+
+    def search(self, session: Session, query: str, limit: int, offset: int) -> List[SearchHit]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Quote every term so user input is never parsed as FTS5 query syntax.
+        match = " ".join(f'"{term}"' for term in terms)
+        rows = session.execute(
+            text(
+                "SELECT rowid, snippet(post_search, 2, :start, :end, '…', 24) FROM post_search "
+                "WHERE post_search MATCH :match "
+                f"ORDER BY bm25(post_search, {_TITLE_WEIGHT}, {_SUBTITLE_WEIGHT}, {_BODY_WEIGHT}) "
+                "LIMIT :limit OFFSET :offset"
+            ),
+            {"start": _MATCH_START, "end": _MATCH_END, "match": match, "limit": limit, "offset": offset}
+        ).all()
+        return [SearchHit(post_id=row[0], snippet=_render_snippet(row[1])) for row in rows]
+
+
+class InvertedIndexEngine:
+    """
+        Portable search over the search_terms posting table, ranked with tf-idf.
+    """
+    name = "inverted"
+
+    @staticmethod
+    def _postings(post_id: int, title: str, subtitle: str, body: str) -> List[dict]:
+        weights = Counter()
+        for weight, value in ((_TITLE_WEIGHT, title), (_SUBTITLE_WEIGHT, subtitle), (_BODY_WEIGHT, strip_html(body))):
+            for token in tokenize(value or ""):
+                weights[token] += weight
+        return [{"term": term, "post_id": post_id, "weight": weight} for term, weight in weights.items()]
+
+    def index_post(self, session: Session, post_id: int, title: str, subtitle: str, body: str):
+        self.remove_post(session, post_id)
+        self.index_posts(session, [{"id": post_id, "title": title, "subtitle": subtitle, "body": body}])
+
+    def index_posts(self, session: Session, posts: List[dict]):
+        postings = [posting for post in posts for posting in self._postings(
+            post["id"], post["title"], post["subtitle"], post["body"])]
+        if postings:
+            session.execute(insert(SearchTerm), postings)
+
+    def remove_post(self, session: Session, post_id: int):
+        session.execute(delete(SearchTerm).where(SearchTerm.post_id == post_id))
+
+    def clear(self, session: Session):
+        session.execute(delete(SearchTerm))
+
+    def search(self, session: Session, query: str, limit: int, offset: int) -> List[SearchHit]:
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        document_frequencies = dict(session.execute(
+            db.select(SearchTerm.term, func.count()).where(SearchTerm.term.in_(terms)).group_by(SearchTerm.term)
+        ).all())
+        if len(document_frequencies) < len(terms):
+            return []
+        document_count = session.execute(db.select(func.count(BlogPost.id))).scalar()
+        idf = {term: math.log(1 + document_count / frequency) for term, frequency in document_frequencies.items()}
+        score = func.sum(SearchTerm.weight * case(idf, value=SearchTerm.term, else_=0.0))
+        rows = session.execute(
+            db.select(SearchTerm.post_id)
+            .where(SearchTerm.term.in_(terms))
+            .group_by(SearchTerm.post_id)
+            .having(func.count() == len(terms))
+            .order_by(score.desc(), SearchTerm.post_id.desc())
+            .limit(limit).offset(offset)
+        ).scalars().all()
+        return [SearchHit(post_id=post_id, snippet=Markup()) for post_id in rows]
+
+
+def init_app(app: Flask):
+    """
+        Picks the search engine configured by SEARCH_ENGINE. "auto" uses FTS5 on SQLite databases
+        and the inverted index everywhere else.
+    """
+    engine_name = app.config.get("SEARCH_ENGINE", "auto")
+    if engine_name == "auto":
+        database_uri = app.config.get("SQLALCHEMY_DATABASE_URI") or ""
+        engine_name = "fts5" if database_uri.startswith("sqlite") else "inverted"
+    engines = {SQLiteFTSEngine.name: SQLiteFTSEngine, InvertedIndexEngine.name: InvertedIndexEngine}
+    if engine_name not in engines:
+        raise ValueError(f"Unknown SEARCH_ENGINE: {engine_name}")
+    app.extensions["search_engine"] = engines[engine_name]()
+
+
+def get_search_engine():
+    return current_app.extensions["search_engine"]
+
+
+def rebuild_index(session: Session, batch_size: int = 1000) -> Iterable[int]:
+    """
+        Re-indexes every post in one transaction, reading the posts in batches.
+        Yields the number of posts indexed so far after each batch; the caller commits.
+    """
+    engine = get_search_engine()
+    if engine.name == SQLiteFTSEngine.name:
+        create_fts_table(session.connection())
+    engine.clear(session)
+    rows = session.execute(
+        db.select(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.body)
+        .order_by(BlogPost.id)
+        .execution_options(yield_per=batch_size)
+    )
+    indexed = 0
+    for batch in rows.partitions():
+        engine.index_posts(session, [dict(row._mapping) for row in batch])
+        indexed += len(batch)
+        yield indexed
+
+
+def create_fts_table(connection):
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS post_search "
+        "USING fts5(title, subtitle, body, tokenize='porter unicode61')"
+    ))
+
+
+@event.listens_for(db.metadata, "after_create")
+def _create_fts_table(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        create_fts_table(connection)
+
+
+@event.listens_for(db.metadata, "before_drop")
+def _drop_fts_table(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("DROP TABLE IF EXISTS post_search"))
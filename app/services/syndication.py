@@ -0,0 +1,235 @@
+"""
+Precomputed RSS feed and sitemap files, shared by all workers through SYNDICATION_DIR.
+
+A file is generated the first time it is requested and served as a static file from then on,
+with ETag and Last-Modified, until a post change deletes it. The sitemap lists posts in shards
+of SITEMAP_SHARD_SIZE consecutive post ids, so a change only rebuilds one shard; past one shard,
+sitemap.xml becomes an index of the shard files. A file whose generation overlapped an
+invalidation is thrown away instead of being kept, since it may have been built from old rows.
+Links are built on SYNDICATION_BASE_URL, never on the Host of the request that happened to
+generate the file.
+"""
+import io
+import logging
+import os
+import tempfile
+import uuid
+from datetime import timezone
+from email.utils import format_datetime
+from typing import BinaryIO, Callable, Iterable, Optional, Union
+from xml.sax.saxutils import escape
+
+from flask import Flask, current_app, url_for
+
+logger = logging.getLogger(__name__)
+
+FEED = "feed.xml"
+SITEMAP = "sitemap.xml"
+# Rewritten with a new token by every invalidation, in any worker.
+_INVALIDATION_MARKER = ".invalidated"
+_GENERATION_ATTEMPTS = 3
+
+
+def _shard_name(shard: int) -> str:
+    return f"sitemap-{shard}.xml"
+
+
+class SyndicationStore:
+    def __init__(self, directory: str, feed_size: int, shard_size: int, base_url: str):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        self.feed_size = feed_size
+        self.shard_size = shard_size
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _invalidation_token(self) -> str:
+        try:
+            with open(self._path(_INVALIDATION_MARKER), encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return ""
+
+    def _mark_invalidated(self):
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            file.write(uuid.uuid4().hex)
+        os.replace(temporary_path, self._path(_INVALIDATION_MARKER))
+
+    def _write(self, name: str, lines: Iterable[str], token: str) -> Optional[str]:
+        # Written aside and renamed, so a worker never serves a half written file. The token is
+        # checked again after the rename: an invalidation marks before it deletes, so one that
+        # slipped in between either shows here or deletes the file itself.
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+                file.writelines(lines)
+            if self._invalidation_token() != token:
+                os.unlink(temporary_path)
+                return None
+            os.replace(temporary_path, self._path(name))
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        if self._invalidation_token() != token:
+            self._delete(name)
+            return None
+        logger.info("Generated %s.", name)
+        return self._path(name)
+
+    def _get(self, name: str, generate: Callable[[], Iterable[str]]) -> Union[str, BinaryIO]:
+        """
+            Returns the path of the file, generating it if needed. When posts keep changing while it
+            is generated, the last attempt is returned in memory and not kept.
+        """
+        path = self._path(name)
+        if os.path.exists(path):
+            return path
+        for _ in range(_GENERATION_ATTEMPTS):
+            path = self._write(name, generate(), self._invalidation_token())
+            if path is not None:
+                return path
+        logger.warning("%s changed during each of %s generations, serving it without keeping it.",
+                       name, _GENERATION_ATTEMPTS)
+        return io.BytesIO("".join(generate()).encode("utf-8"))
+
+    def _delete(self, *names: str):
+        for name in names:
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def shard_of(self, post_id: int) -> int:
+        return (post_id - 1) // self.shard_size
+
+    def feed_path(self) -> Union[str, BinaryIO]:
+        return self._get(FEED, self._feed_lines)
+
+    def sitemap_path(self) -> Union[str, BinaryIO]:
+        return self._get(SITEMAP, self._sitemap_lines)
+
+    def shard_path(self, shard: int) -> Optional[Union[str, BinaryIO]]:
+        """
+            Returns the path of the shard file, or None when the shard is past the last post, in
+            which case no file is written.
+        """
+        path = self._path(_shard_name(shard))
+        if os.path.exists(path):
+            return path
+        from app.database import crud_post, db
+
+        if shard > self.shard_of(crud_post.get_last_post_id(db=db) or 1):
+            return None
+        return self._get(_shard_name(shard), lambda: self._shard_lines(shard))
+
+    def invalidate_post(self, post_id: int, listing_changed: bool):
+        """
+            Deletes the files showing the post. listing_changed is set when the post was created
+            or deleted, which can change the number of shards.
+        """
+        self._mark_invalidated()
+        self._delete(FEED, _shard_name(self.shard_of(post_id)))
+        if listing_changed or self.shard_of(post_id) == 0:
+            self._delete(SITEMAP)
+
+    def invalidate_all(self):
+        self._mark_invalidated()
+        self._delete(*(name for name in os.listdir(self.directory) if name.endswith(".xml")))
+
+    def _url(self, endpoint: str, **values) -> str:
+        return escape(self.base_url + url_for(endpoint, **values))
+
+    # Generation reads from the primary: a file built from a lagging replica would be served
+    # until the next change. crud_post imports this module, hence the imports inside the methods.
+
+    def _feed_lines(self) -> Iterable[str]:
+        from app.database import crud_post, db
+
+        posts = crud_post.get_latest_posts(db=db, limit=self.feed_size)
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/">\n<channel>\n'
+        yield f"<title>{escape(current_app.config['SYNDICATION_TITLE'])}</title>\n"
+        yield f"<link>{self._url('post_routes.get_all_posts')}</link>\n"
+        yield f"<description>{escape(current_app.config['SYNDICATION_DESCRIPTION'])}</description>\n"
+        for post in posts:
+            link = self._url("post_routes.show_post", post_id=post.id)
+            yield "<item>\n"
+            yield f"<title>{escape(post.title)}</title>\n<link>{link}</link>\n<guid>{link}</guid>\n"
+            yield f"<description>{escape(post.subtitle)}</description>\n"
+            # <author> would have to be an email address; dc:creator takes the name alone.
+            if post.author is not None and post.author.name:
+                yield f"<dc:creator>{escape(post.author.name)}</dc:creator>\n"
+            yield f"<pubDate>{format_datetime(post.created_at.replace(tzinfo=timezone.utc))}</pubDate>\n"
+            yield "</item>\n"
+        yield "</channel>\n</rss>\n"
+
+    def _sitemap_lines(self) -> Iterable[str]:
+        from app.database import crud_post, db
+
+        last_post_id = crud_post.get_last_post_id(db=db) or 0
+        if last_post_id <= self.shard_size:
+            yield from self._shard_lines(0)
+            return
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        for shard in range(self.shard_of(last_post_id) + 1):
+            location = self._url("feed_routes.sitemap_shard", shard=shard)
+            yield f"<sitemap><loc>{location}</loc></sitemap>\n"
+        yield "</sitemapindex>\n"
+
+    def _shard_lines(self, shard: int) -> Iterable[str]:
+        from app.database import crud_post, db
+
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        if shard == 0:
+            for endpoint in ("post_routes.get_all_posts", "static_routes.about", "static_routes.contact"):
+                yield f"<url><loc>{self._url(endpoint)}</loc></url>\n"
+        first_id = shard * self.shard_size + 1
+        for entry in crud_post.get_post_sitemap_entries(db=db, first_id=first_id,
+                                                        last_id=first_id + self.shard_size - 1):
+            location = self._url("post_routes.show_post", post_id=entry.id)
+            lastmod = entry.updated_at.replace(microsecond=0).isoformat() + "+00:00"
+            yield f"<url><loc>{location}</loc><lastmod>{lastmod}</lastmod></url>\n"
+        yield "</urlset>\n"
+
+
+def init_app(app: Flask):
+    """
+        Creates the store of the feed and sitemap files configured by SYNDICATION_* and attaches
+        it to the app.
+    """
+    base_url = app.config["SYNDICATION_BASE_URL"]
+    if not base_url and app.config.get("SERVER_NAME"):
+        base_url = f"{app.config['PREFERRED_URL_SCHEME']}://{app.config['SERVER_NAME']}"
+    if not base_url:
+        base_url = "http://localhost"
+        logger.warning("Neither SYNDICATION_BASE_URL nor SERVER_NAME is set, the feed and sitemap link to %s.",
+                       base_url)
+    app.extensions["syndication"] = SyndicationStore(
+        directory=os.path.abspath(app.config["SYNDICATION_DIR"]),
+        feed_size=app.config["SYNDICATION_FEED_SIZE"],
+        shard_size=app.config["SITEMAP_SHARD_SIZE"],
+        base_url=base_url
+    )
+
+
+def get_syndication_store() -> SyndicationStore:
+    return current_app.extensions["syndication"]
+
+
+def invalidate_post(post_id: int, listing_changed: bool = False):
+    store = current_app.extensions.get("syndication")
+    if store is not None:
+        store.invalidate_post(post_id, listing_changed)
+
+
+def invalidate_all():
+    store = current_app.extensions.get("syndication")
+    if store is not None:
+        store.invalidate_all()
@@ -0,0 +1,154 @@
+"""
+Write-behind view counts of the posts.
+
+Views are counted in memory and added to post_stats.view_count by a background thread, in one
+batched UPDATE every VIEW_COUNTER_FLUSH_INTERVAL seconds or VIEW_COUNTER_FLUSH_THRESHOLD views,
+whichever comes first, so reading a post never writes to the database. Counts still in memory are
+flushed when the process exits normally; a killed worker loses at most one interval of views.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from flask import Flask, current_app, request
+from sqlalchemy import bindparam, update
+
+from app.database import db
+from app.models import PostStats
+from app.services import page_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+        Aggregates view counts per post id, safe to increment from any thread. The flush thread is
+        started on the first view in each process, so forked workers each run their own.
+    """
+
+    def __init__(self, app: Flask, flush_interval: float, flush_threshold: int):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.flushed_views = 0
+        self._pending: Counter = Counter()
+        self._pending_views = 0
+        self._lock = threading.Lock()
+        # Serializes flushes, so the counts of a failed flush are put back before the next one runs.
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+
+    def increment(self, post_id: int):
+        with self._lock:
+            self._pending[post_id] += 1
+            self._pending_views += 1
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._start()
+            if self._pending_views >= self.flush_threshold:
+                self._wake.set()
+
+    def pending(self) -> Dict[int, int]:
+        with self._lock:
+            return dict(self._pending)
+
+    def _start(self):
+        if self._thread_pid is None:
+            atexit.register(self.shutdown)
+        self._thread_pid = os.getpid()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="view-counter", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """
+            Adds the counted views to post_stats in one executemany and one commit. On failure the
+            counts are kept for the next flush.
+
+            Returns:
+            - int: The number of views written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                deltas, self._pending = self._pending, Counter()
+                self._pending_views = 0
+            if not deltas:
+                return 0
+            stats = PostStats.__table__
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as connection:
+                        connection.execute(
+                            update(stats).where(stats.c.post_id == bindparam("match_post_id"))
+                            .values(view_count=stats.c.view_count + bindparam("delta")),
+                            [{"match_post_id": post_id, "delta": delta} for post_id, delta in deltas.items()]
+                        )
+                    page_cache.invalidate_most_viewed()
+            except Exception as e:
+                with self._lock:
+                    self._pending.update(deltas)
+                    self._pending_views += sum(deltas.values())
+                logger.error("Error flushing the views of %s posts: %s", len(deltas), e)
+                return 0
+            views = sum(deltas.values())
+            self.flushed_views += views
+            logger.info("Flushed %s views of %s posts.", views, len(deltas))
+            return views
+
+    def shutdown(self):
+        """
+            Stops the flush thread and writes the views still in memory.
+        """
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+def init_app(app: Flask):
+    """
+        Creates the view counter configured by VIEW_COUNTER_* and attaches it to the app.
+    """
+    app.extensions["view_counter"] = ViewCounter(
+        app,
+        flush_interval=app.config["VIEW_COUNTER_FLUSH_INTERVAL"],
+        flush_threshold=app.config["VIEW_COUNTER_FLUSH_THRESHOLD"]
+    ) if app.config.get("VIEW_COUNTER_ENABLED") else None
+
+
+def get_view_counter() -> Optional[ViewCounter]:
+    return current_app.extensions.get("view_counter")
+
+
+def counts_views(get_post_id: Callable[..., int]):
+    """
+        Counts a view of the post whose id get_post_id returns from the view arguments, for every
+        GET answered with 200 or 304. Apply it above cached_page and conditional_page, so cache hits
+        and revalidations are counted too.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            response = current_app.make_response(f(*args, **kwargs))
+            counter = get_view_counter()
+            if counter is not None and request.method == "GET" and response.status_code in (200, 304):
+                counter.increment(get_post_id(**kwargs))
+            return response
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,47 @@
+// Loads the comments of a post beyond the first page from /post/<id>/comments, one page per click.
+window.addEventListener('DOMContentLoaded', () => {
+    const button = document.querySelector('[data-comments-url]');
+    if (!button) {
+        return;
+    }
+    const list = document.querySelector('.commentList');
+
+    function renderComment(comment) {
+        const item = document.createElement('li');
+        const image = document.createElement('div');
+        image.className = 'commenterImage';
+        const avatar = document.createElement('img');
+        avatar.src = comment.avatar;
+        avatar.loading = 'lazy';
+        const text = document.createElement('div');
+        text.className = 'commentText';
+        // Sanitized when the comment was saved.
+        text.innerHTML = comment.html;
+        const meta = document.createElement('span');
+        meta.className = 'comment-meta';
+        meta.textContent = '  --commented by ' + comment.author + ' ';
+        text.appendChild(meta);
+        image.append(avatar, text);
+        item.appendChild(image);
+        return item;
+    }
+
+    button.addEventListener('click', async () => {
+        button.disabled = true;
+        try {
+            const response = await fetch(button.dataset.commentsUrl, {headers: {'Accept': 'application/json'}});
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            const page = await response.json();
+            list.append(...page.comments.map(renderComment));
+            if (page.next_url) {
+                button.dataset.commentsUrl = page.next_url;
+            } else {
+                button.parentElement.remove();
+            }
+        } finally {
+            button.disabled = false;
+        }
+    });
+});
@@ -1 +1,2 @@
-from .logger import setup_logger
\ No newline at end of file
+from .logger import setup_logger, init_request_ids
+from .json_provider import init_json
@@ -1,5 +1,158 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
 
+from flask import Flask, g, has_request_context, request
 
-def setup_logger():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+_STANDARD_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+_listener: Optional[QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps every record with the id of the request it was logged in, if any."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+        Keeps only a fraction of the INFO (and lower) records of the configured loggers and their
+        children. Warnings and errors always pass.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, candidate = 1.0, name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        document.update({key: value for key, value in vars(record).items() if key not in _STANDARD_RECORD_FIELDS})
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            document["exception"] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped and counted."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The default folds the traceback into the message and clears it. The traceback is kept
+        # in exc_text instead, formatted here since the frames may be gone by the time the
+        # listener thread writes the record.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def setup_logger(level: str = "INFO", log_format: str = "json", sampling: Optional[Dict[str, float]] = None,
+                 queue_size: int = 10000):
+    """
+        Routes the root logger through a bounded queue to a background thread that does the I/O.
+
+        Filters run in the logging thread before the record is queued, so sampled-out records are
+        never formatted. Calling it again replaces the previous pipeline.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if log_format == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(request_id)s - %(message)s"))
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sampling or {}))
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in [handler for handler in root.handlers if isinstance(handler, DroppingQueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logger():
+    """Writes out the queued records and stops the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logger)
+
+
+def init_request_ids(app: Flask):
+    """
+        Gives every request an id, taken from the X-Request-ID header when the proxy sets one,
+        and returns it in the response.
+    """
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+
+    @app.after_request
+    def return_request_id(response):
+        response.headers["X-Request-ID"] = g.get("request_id", "")
+        return response
@@ -0,0 +1,186 @@
+import bisect
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from flask import Flask, current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+        Counters and histograms of this process, labelled and aggregated in memory under one lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._histogram_buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def counter(self, name: str, help_text: str):
+        self._help[name] = ("counter", help_text)
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float]):
+        self._help[name] = ("histogram", help_text)
+        self._histograms.setdefault(name, {})
+        self._histogram_buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, labels: Labels, amount: float = 1):
+        with self._lock:
+            series = self._counters[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe_many(self, observations: List[Tuple[str, Labels, float]]):
+        with self._lock:
+            for name, labels, value in observations:
+                series = self._histograms[name]
+                histogram = series.get(labels)
+                if histogram is None:
+                    histogram = series[labels] = Histogram(self._histogram_buckets[name])
+                histogram.observe(value)
+
+    def render(self, extra: Dict[str, Tuple[str, str, float]] = None) -> str:
+        """
+            Renders every series in the Prometheus text exposition format, followed by the
+            unlabelled extra series given as {name: (type, help, value)}.
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines += [f"# HELP {name} {self._help[name][1]}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels(labels)} {value}" for labels, value in sorted(series.items())]
+            for name, series in self._histograms.items():
+                lines += [f"# HELP {name} {self._help[name][1]}", f"# TYPE {name} histogram"]
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, (metric_type, help_text, value) in (extra or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _create_registry() -> MetricsRegistry:
+    registry = MetricsRegistry()
+    registry.counter("http_requests_total", "Requests by route, method and status.")
+    registry.histogram("http_request_duration_seconds", "Time spent handling a request.", LATENCY_BUCKETS)
+    registry.histogram("http_response_size_bytes", "Size of the response bodies.", SIZE_BUCKETS)
+    registry.histogram("http_request_sql_statements", "SQL statements executed per request.", COUNT_BUCKETS)
+    registry.histogram("http_request_sql_duration_seconds", "Time spent in SQL per request.", LATENCY_BUCKETS)
+    registry.histogram("http_request_render_duration_seconds", "Time spent rendering templates per request.",
+                       LATENCY_BUCKETS)
+    return registry
+
+
+# The start time is kept on the execution context of the statement, which is dropped with it even
+# when the statement raises and after_cursor_execute never runs.
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context():
+        context.metrics_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_query_start", None)
+    if started is not None and has_request_context():
+        g.metrics_sql_statements = g.get("metrics_sql_statements", 0) + 1
+        g.metrics_sql_seconds = g.get("metrics_sql_seconds", 0.0) + time.perf_counter() - started
+
+
+def _before_render_template(sender, template, context, **extra):
+    if has_request_context():
+        g.metrics_render_started = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    if has_request_context() and "metrics_render_started" in g:
+        elapsed = time.perf_counter() - g.metrics_render_started
+        g.metrics_render_seconds = g.get("metrics_render_seconds", 0.0) + elapsed
+
+
+_listeners_installed = False
+
+
+def _install_listeners():
+    # Engine-level listeners cover the primary and every bind; they are process wide, so install them once.
+    global _listeners_installed
+    if not _listeners_installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _listeners_installed = True
+
+
+def init_app(app: Flask):
+    """
+        Records latency, response size, SQL statement count and time, and template render time
+        for every request, per route, when METRICS_ENABLED is set.
+    """
+    app.extensions["metrics"] = None
+    if not app.config.get("METRICS_ENABLED"):
+        return
+    registry = app.extensions["metrics"] = _create_registry()
+    _install_listeners()
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql_statements = 0
+        g.metrics_sql_seconds = 0.0
+        g.metrics_render_seconds = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if "metrics_started" not in g:
+            return response
+        route = (("route", request.url_rule.rule if request.url_rule else "unmatched"), ("method", request.method))
+        registry.inc("http_requests_total", route + (("status", str(response.status_code)),))
+        observations = [
+            ("http_request_duration_seconds", route, time.perf_counter() - g.metrics_started),
+            ("http_request_sql_statements", route, g.metrics_sql_statements),
+            ("http_request_sql_duration_seconds", route, g.metrics_sql_seconds),
+            ("http_request_render_duration_seconds", route, g.metrics_render_seconds),
+        ]
+        if response.content_length is not None:
+            observations.append(("http_response_size_bytes", route, response.content_length))
+        registry.observe_many(observations)
+        return response
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return current_app.extensions.get("metrics")
@@ -0,0 +1,28 @@
+from typing import Iterable, Iterator
+
+from flask import Response, current_app, render_template, stream_template
+
+
+def _buffered(chunks: Iterable[str], size: int) -> Iterator[str]:
+    # Jinja yields a chunk per template node; sending each as a write would cost a syscall apiece.
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def render_page(template_name: str, **context):
+    """
+        Renders a page, or streams it when STREAM_TEMPLATES is set: the response starts as soon as
+        STREAM_BUFFER_SIZE characters are rendered, and lazy iterables in the context, e.g. of
+        query results, are consumed while the page is being sent.
+    """
+    if not current_app.config.get("STREAM_TEMPLATES"):
+        return render_template(template_name, **context)
+    chunks = stream_template(template_name, **context)
+    return Response(_buffered(chunks, current_app.config["STREAM_BUFFER_SIZE"]), mimetype="text/html")
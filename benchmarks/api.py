@@ -0,0 +1,107 @@
+"""
+Compares the per-request cost of the JSON API with the HTML pages clients used to scrape.
+
+    python -m benchmarks.api --posts 10000 --comments 100000 --requests 500 --output api.json
+
+Seeds a temporary SQLite file (or reuses --db), then requests each route --requests times through
+the test client of the app, in one thread, so the numbers are the cost of the request itself:
+median and p95 time, SQL statements and response bytes. The page cache is disabled so every
+request is served by the view.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from app.database import db
+from benchmarks.run import _git_revision, create_benchmark_app, percentile
+from benchmarks.seed import seed_dataset
+
+ROUTES = {
+    "index_html": lambda post_id: "/",
+    "posts_api": lambda post_id: "/api/v1/posts?fields=id,title,subtitle,author,date",
+    "post_html": lambda post_id: f"/post/{post_id}",
+    "post_api": lambda post_id: f"/api/v1/posts/{post_id}",
+    "posts_by_ids_api": lambda post_id: f"/api/v1/posts?ids={','.join(str(post_id - n) for n in range(10))}"
+                                        "&fields=title,comment_count",
+}
+
+
+def measure(app, path_of, posts: int, requests: int, rng: random.Random) -> dict:
+    client = app.test_client()
+    statements = []
+    record = lambda *args: statements.append(1)
+    timings, sizes = [], []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        for _ in range(requests):
+            path = path_of(rng.randint(10, posts))
+            started = time.perf_counter()
+            response = client.get(path)
+            body = response.get_data()
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {path} returned {response.status_code}")
+            sizes.append(len(body))
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", record)
+    return {
+        "ms_p50": round(statistics.median(timings), 3),
+        "ms_p95": round(percentile(timings, 0.95), 3),
+        "sql_statements_per_request": round(len(statements) / requests, 2),
+        "bytes_p50": int(statistics.median(sizes)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Seeded SQLite file to reuse; a temporary one is seeded when omitted.")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--comments", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per route.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = args.db or os.path.join(directory, "bench.sqlite3")
+        app = create_benchmark_app(database_path)
+        logging.getLogger().setLevel(logging.WARNING)
+        if not args.db:
+            with app.app_context():
+                db.create_all()
+                seed_dataset(args.users, args.posts, args.comments, seed=args.seed, build_search_index=False,
+                             progress=lambda message: print(message, file=sys.stderr, flush=True))
+        report = {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "json_provider": type(app.json).__name__,
+            "dataset": {"users": args.users, "posts": args.posts, "comments": args.comments},
+            "requests_per_route": args.requests,
+            "routes": {
+                name: measure(app, path_of, args.posts, args.requests, random.Random(args.seed))
+                for name, path_of in ROUTES.items()
+            },
+        }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
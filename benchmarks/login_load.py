@@ -0,0 +1,105 @@
+"""
+Measures page latency while the site is under a login burst, with and without the hashing pool.
+
+    python -m benchmarks.login_load --login-clients 16 --seconds 10
+
+For each PASSWORD_HASH_WORKERS setting the app is served by a threaded werkzeug server, login
+clients post valid credentials in a loop and one client times GET /about. Prints JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from config import TestConfig
+from app import create_app
+from app.database import db
+from app.models import User
+from app.services import authentication
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)], 2) if samples else 0.0
+
+
+def run(hash_workers: int, login_clients: int, seconds: float, directory: str) -> dict:
+    class BenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, f'login-{hash_workers}.sqlite3')}"
+        PASSWORD_HASH_METHOD = authentication.DEFAULT_HASH_METHOD
+        PASSWORD_HASH_WORKERS = hash_workers
+        PASSWORD_HASH_QUEUE_LIMIT = login_clients
+        RAISE_ON_LAZY_LOAD = False
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(email="bench@example.com", name="Bench",
+                            password=authentication.hash_user_password("secret")))
+        db.session.commit()
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    deadline = time.monotonic() + seconds
+    login_statuses = []
+    page_latencies = []
+    body = urllib.parse.urlencode({"email": "bench@example.com", "password": "secret"}).encode()
+
+    def login_client():
+        while time.monotonic() < deadline:
+            try:
+                status = urllib.request.urlopen(f"{base_url}/login", data=body).status
+            except urllib.error.HTTPError as error:
+                status = error.code
+            login_statuses.append(status)
+
+    def page_client():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            urllib.request.urlopen(f"{base_url}/about").read()
+            page_latencies.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.05)
+
+    clients = [threading.Thread(target=login_client) for _ in range(login_clients)]
+    clients.append(threading.Thread(target=page_client))
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    server.shutdown()
+    app.extensions["password_hasher"].shutdown()
+
+    return {
+        "hash_workers": hash_workers,
+        "logins_per_second": round(sum(status == 200 for status in login_statuses) / seconds, 1),
+        "rejected_503": sum(status == 503 for status in login_statuses),
+        "page_p50_ms": percentile(page_latencies, 0.50),
+        "page_p95_ms": percentile(page_latencies, 0.95),
+        "page_p99_ms": percentile(page_latencies, 0.99),
+        "page_mean_ms": round(statistics.mean(page_latencies), 2) if page_latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--login-clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--pool-workers", type=int, default=min(os.cpu_count() or 1, 4))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run(workers, args.login_clients, args.seconds, directory) for workers in (0, args.pool_workers)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Drives the main routes with concurrent clients and reports latency, throughput and SQL per request.
+
+    python -m benchmarks.run --users 10000 --posts 100000 --comments 2000000 --output release.json
+
+Builds the app with create_app(TestConfig) on a file-backed SQLite database, seeds it (or reuses
+--db), serves it from a threaded werkzeug server and runs each scenario in turn. Pass --url to
+benchmark an already running deployment of a seeded database instead. SQL statements per request
+are read from the /metrics endpoint before and after each scenario. The JSON report is stable
+across runs so that two releases can be diffed.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from typing import Callable, Dict, Optional
+
+from werkzeug.serving import make_server
+
+from config import TestConfig
+from app import create_app
+from app.database import db
+from benchmarks.seed import BENCHMARK_PASSWORD, seed_dataset
+
+
+def create_benchmark_app(database_path: str):
+    class BenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath(database_path)}"
+        RAISE_ON_LAZY_LOAD = False
+        LOG_LEVEL = "WARNING"
+
+    return create_app(BenchmarkConfig)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    """A browser-like client with its own cookie jar that does not follow redirects."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect())
+
+    def request(self, path: str, data: Optional[dict] = None) -> int:
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self._opener.open(self.base_url + path, data=body) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+    def login(self, email: str):
+        self.request("/login", {"email": email, "password": BENCHMARK_PASSWORD})
+
+
+class Scenario:
+    def __init__(self, route: str, method: str, run: Callable[[Client, random.Random, int], int],
+                 login_as: Optional[Callable[[random.Random], str]] = None):
+        self.route = route
+        self.method = method
+        self.run = run
+        self.login_as = login_as
+
+
+def _recent_post(rng: random.Random, dataset: dict) -> int:
+    # Same skew as the seeded comments: popular, recent posts get most views.
+    return dataset["posts"] - int(dataset["posts"] * rng.random() ** 4)
+
+
+def build_scenarios(dataset: dict, run_id: str) -> Dict[str, Scenario]:
+    def index(client, rng, number):
+        if number % 2:
+            return client.request("/")
+        return client.request(f"/?before={rng.randint(1, dataset['posts'])}")
+
+    def post_page(client, rng, number):
+        return client.request(f"/post/{_recent_post(rng, dataset)}")
+
+    def comment_submit(client, rng, number):
+        return client.request(f"/post/{_recent_post(rng, dataset)}",
+                              {"comment_text": f"Benchmark comment {run_id}-{number}"})
+
+    def login(client, rng, number):
+        return client.request("/login", {"email": f"user{rng.randint(1, dataset['users'])}@example.com",
+                                         "password": BENCHMARK_PASSWORD})
+
+    def register(client, rng, number):
+        return client.request("/register", {"email": f"new-{run_id}-{number}@example.com",
+                                            "password": BENCHMARK_PASSWORD, "name": f"New user {number}"})
+
+    def admin_edit(client, rng, number):
+        post_id = rng.randint(1, dataset["posts"])
+        return client.request(f"/edit/{post_id}", {
+            "title": f"Benchmark post {post_id}",
+            "subtitle": f"Edited in run {run_id}",
+            "img_url": "https://example.com/image.jpg",
+            "body": f"<p>Edited body {number}.</p>",
+        })
+
+    return {
+        "index": Scenario("/", "GET", index),
+        "post_page": Scenario("/post/<int:post_id>", "GET", post_page),
+        "comment_submit": Scenario("/post/<int:post_id>", "POST", comment_submit,
+                                   login_as=lambda rng: f"user{rng.randint(1, dataset['users'])}@example.com"),
+        "login": Scenario("/login", "POST", login),
+        "register": Scenario("/register", "POST", register),
+        "admin_edit": Scenario("/edit/<int:post_id>", "POST", admin_edit, login_as=lambda rng: "user1@example.com"),
+    }
+
+
+_SQL_SUM = re.compile(r'^http_request_sql_statements_sum\{route="([^"]*)",method="([^"]*)"\} (\S+)$', re.M)
+_SQL_COUNT = re.compile(r'^http_request_sql_statements_count\{route="([^"]*)",method="([^"]*)"\} (\S+)$', re.M)
+
+
+def read_sql_totals(base_url: str) -> dict:
+    try:
+        with urllib.request.urlopen(base_url + "/metrics") as response:
+            body = response.read().decode()
+    except urllib.error.URLError:
+        return {}
+    sums = {(route, method): float(value) for route, method, value in _SQL_SUM.findall(body)}
+    counts = {(route, method): float(value) for route, method, value in _SQL_COUNT.findall(body)}
+    return {key: (sums[key], counts.get(key, 0)) for key in sums}
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)], 3) if samples else 0.0
+
+
+def run_scenario(base_url: str, scenario: Scenario, requests: int, concurrency: int, seed: int) -> dict:
+    counter = itertools.count()
+    latencies, statuses = [], []
+    lock = threading.Lock()
+
+    def worker(worker_number: int):
+        rng = random.Random(seed * 1000 + worker_number)
+        client = Client(base_url)
+        if scenario.login_as:
+            client.login(scenario.login_as(rng))
+        while (number := next(counter)) < requests:
+            started = time.perf_counter()
+            status = scenario.run(client, rng, number)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+
+    before = read_sql_totals(base_url)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    after = read_sql_totals(base_url)
+
+    key = (scenario.route, scenario.method)
+    sql_per_request = None
+    if key in after:
+        statements = after[key][0] - before.get(key, (0, 0))[0]
+        measured = after[key][1] - before.get(key, (0, 0))[1]
+        sql_per_request = round(statements / measured, 2) if measured else None
+
+    return {
+        "requests": len(latencies),
+        "errors": sum(status >= 400 for status in statuses),
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "sql_statements_per_request": sql_per_request,
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Seeded SQLite file to reuse; a temporary one is seeded when omitted.")
+    parser.add_argument("--url", help="Benchmark a running server of a seeded database instead.")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--comments", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default="index,post_page,comment_submit,login,register,admin_edit")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    dataset = {"users": args.users, "posts": args.posts, "comments": args.comments}
+    run_id = f"{int(time.time())}"
+    server = None
+    with tempfile.TemporaryDirectory() as directory:
+        base_url = args.url
+        if not base_url:
+            database_path = args.db or os.path.join(directory, "bench.sqlite3")
+            app = create_benchmark_app(database_path)
+            if not args.db:
+                with app.app_context():
+                    db.create_all()
+                    seed_dataset(args.users, args.posts, args.comments, seed=args.seed,
+                                 progress=lambda message: print(message, file=sys.stderr, flush=True))
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            server = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.server_port}"
+
+        scenarios = build_scenarios(dataset, run_id)
+        report = {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "dataset": dataset,
+            "requests_per_scenario": args.requests,
+            "concurrency": args.concurrency,
+            "scenarios": {
+                name: run_scenario(base_url, scenarios[name], args.requests, args.concurrency, args.seed)
+                for name in args.scenarios.split(",")
+            },
+        }
+        if server is not None:
+            server.shutdown()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
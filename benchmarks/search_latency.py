@@ -0,0 +1,116 @@
+"""
+Measures search latency over a seeded database of posts.
+
+    python -m benchmarks.search_latency --posts 100000 --engine fts5
+
+Seeds a temporary SQLite file, builds the index with the rebuild command's code path and
+times each query through crud_post.search_posts, next to the unranked LIKE scan it replaces.
+Prints the results as JSON.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+from config import TestConfig
+from app import create_app
+from app.database import db, crud_post
+from app.models import BlogPost, User
+from app.services import search
+
+SYLLABLES = ["ba", "ko", "ri", "tem", "lo", "sa", "vin", "de", "mu", "xa", "pe", "rol", "ni", "gu", "fa", "zo"]
+
+
+def vocabulary(size: int) -> list:
+    """Deterministic pseudo-words; used with Zipf weights so term frequencies look like real text."""
+    words = []
+    for number in range(size):
+        word, value = "", number + len(SYLLABLES)
+        while value:
+            value, index = divmod(value, len(SYLLABLES))
+            word += SYLLABLES[index]
+        words.append(word)
+    return words
+
+
+WORDS = vocabulary(20_000)
+CUMULATIVE_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(WORDS) + 1)))
+# One common, one mid-frequency and one rare word, alone and combined.
+QUERIES = [WORDS[5], WORDS[300], WORDS[8000], f"{WORDS[5]} {WORDS[300]}", f"{WORDS[300]} {WORDS[8000]}"]
+
+
+def seed(posts: int, words_per_post: int, batch_size: int = 5000):
+    rng = random.Random(42)
+    db.session.execute(insert(User), [{"id": 1, "email": "bench@example.com", "name": "Bench", "password": "x"}])
+    for start in range(0, posts, batch_size):
+        db.session.execute(insert(BlogPost), [
+            {
+                "id": number + 1,
+                "author_id": 1,
+                "title": f"Post {number} " + " ".join(rng.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=3)),
+                "subtitle": " ".join(rng.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=6)),
+                "date": "January 01, 2024",
+                "body": "<p>" + " ".join(rng.choices(WORDS, cum_weights=CUMULATIVE_WEIGHTS, k=words_per_post)) + "</p>",
+                "img_url": "http://example.com/image.png",
+            }
+            for number in range(start, min(start + batch_size, posts))
+        ])
+    db.session.commit()
+
+
+def time_call(function, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "max_ms": round(max(samples), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--words-per-post", type=int, default=80)
+    parser.add_argument("--engine", choices=["fts5", "inverted"], default="fts5")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        class BenchmarkConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directory, 'bench.sqlite3')}"
+            SEARCH_ENGINE = args.engine
+            RAISE_ON_LAZY_LOAD = False
+
+        app = create_app(BenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            seed(args.posts, args.words_per_post)
+
+            started = time.perf_counter()
+            for _ in search.rebuild_index(db.session, batch_size=2000):
+                pass
+            db.session.commit()
+            report = {
+                "engine": args.engine,
+                "posts": args.posts,
+                "rebuild_seconds": round(time.perf_counter() - started, 2),
+                "queries": {},
+            }
+            for query in QUERIES:
+                report["queries"][query] = {
+                    "index": time_call(lambda: crud_post.search_posts(db=db, query=query, limit=10), args.repeat),
+                    "like_scan": time_call(lambda: db.session.execute(
+                        db.select(BlogPost.id).where(*(BlogPost.body.like(f"%{word}%") for word in query.split()))
+                    ).all(), args.repeat),
+                }
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Seeds a database with a reproducible synthetic dataset using bulk inserts.
+
+    python -m benchmarks.seed --db bench.sqlite3 --users 10000 --posts 100000 --comments 2000000
+
+User 1 is the admin. Every user's password is BENCHMARK_PASSWORD and emails are user<n>@example.com.
+Comments favour recent posts, so a few post pages carry most of them, as on a real blog.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import insert
+
+from app.database import db
+from app.models import BlogPost, Comment, User
+from app.services import authentication, search
+
+BENCHMARK_PASSWORD = "benchmark"
+WORDS = ("flask python database query index cache template request response worker session engine "
+         "thread process memory latency throughput server client render form comment author title "
+         "archive invalidation strategy profile benchmark deploy replica pool sqlite").split()
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    return " ".join(rng.choices(WORDS, k=length)).capitalize() + "."
+
+
+def _post_body(rng: random.Random) -> str:
+    return "".join(f"<p>{' '.join(_sentence(rng, 12) for _ in range(4))}</p>" for _ in range(rng.randint(2, 6)))
+
+
+def seed_dataset(users: int, posts: int, comments: int, batch_size: int = 10_000, seed: int = 42,
+                 build_search_index: bool = True, progress=print):
+    """
+        Inserts users, posts and comments in batches of batch_size rows and commits once per table.
+        Expects an empty schema in the current app context.
+    """
+    rng = random.Random(seed)
+    password_hash = authentication.hash_user_password(BENCHMARK_PASSWORD)
+    started = time.perf_counter()
+
+    def insert_batches(model, total: int, make_row):
+        for start in range(0, total, batch_size):
+            rows = [make_row(number) for number in range(start, min(start + batch_size, total))]
+            db.session.execute(insert(model), rows)
+        db.session.commit()
+        progress(f"Inserted {total} rows into {model.__tablename__} ({time.perf_counter() - started:.1f}s)")
+
+    insert_batches(User, users, lambda number: {
+        "id": number + 1,
+        "email": f"user{number + 1}@example.com",
+        "name": f"User {number + 1}",
+        "password": password_hash,
+        "is_admin": number == 0,
+    })
+    insert_batches(BlogPost, posts, lambda number: {
+        "id": number + 1,
+        "author_id": rng.randint(1, min(users, 20)),
+        "title": f"Benchmark post {number + 1}",
+        "subtitle": _sentence(rng, 6),
+        "date": "January 01, 2024",
+        "body": _post_body(rng),
+        "img_url": "https://example.com/image.jpg",
+    })
+
+    def comment_row(number: int) -> dict:
+        text = f"<p>{_sentence(rng, rng.randint(5, 30))} #{number}</p>"
+        return {
+            "id": number + 1,
+            # Skewed towards the newest posts.
+            "post_id": posts - int(posts * rng.random() ** 4),
+            "author_id": rng.randint(1, users),
+            "text": text,
+            "text_hash": Comment.hash_text(text),
+        }
+
+    insert_batches(Comment, comments, comment_row)
+
+    if build_search_index:
+        for _ in search.rebuild_index(db.session, batch_size=batch_size):
+            pass
+        db.session.commit()
+        progress(f"Built the search index ({time.perf_counter() - started:.1f}s)")
+
+
+def main():
+    from benchmarks.run import create_benchmark_app
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="SQLite file to create.")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--comments", type=int, default=2_000_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    app = create_benchmark_app(args.db)
+    with app.app_context():
+        db.create_all()
+        seed_dataset(args.users, args.posts, args.comments, batch_size=args.batch_size, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Compares concurrent read/write throughput on SQLite for each DB_PRESET.
+
+    python -m benchmarks.sqlite_tuning --readers 8 --writers 2 --seconds 10
+
+For each preset a fresh file database is seeded, then reader threads load random post pages
+(the post with its author and its first page of comments) while writer threads insert comments,
+one per transaction, for the given time. Prints operations per second, latency percentiles and
+"database is locked" errors per preset as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+from config import DATABASE_PRESETS, TestConfig
+from app import create_app
+from app.database import db, crud_comment, crud_post
+from app.models import Comment
+from benchmarks.seed import seed_dataset
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    return round(samples[min(int(len(samples) * fraction), len(samples) - 1)], 3) if samples else 0.0
+
+
+def create_preset_app(database_path: str, preset: str):
+    settings = DATABASE_PRESETS[preset]
+
+    class PresetConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{database_path}"
+        RAISE_ON_LAZY_LOAD = False
+        DB_POOL_PRE_PING = settings["pool_pre_ping"]
+        DB_POOL_RECYCLE = settings["pool_recycle"]
+        SQLITE_JOURNAL_MODE = settings["journal_mode"]
+        SQLITE_SYNCHRONOUS = settings["synchronous"]
+        SQLITE_MMAP_SIZE = settings["mmap_size"]
+        SQLITE_CACHE_SIZE = settings["cache_size"]
+        SQLITE_BUSY_TIMEOUT = settings["busy_timeout"]
+
+    return create_app(PresetConfig)
+
+
+def run_preset(directory: str, preset: str, args) -> dict:
+    app = create_preset_app(os.path.join(directory, f"{preset}.sqlite3"), preset)
+    with app.app_context():
+        db.create_all()
+        seed_dataset(args.users, args.posts, args.comments, build_search_index=False, progress=lambda message: None)
+
+    deadline = time.perf_counter() + args.seconds
+    results = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+
+    def worker(kind: str, number: int):
+        rng = random.Random(number)
+        latencies, failed = [], 0
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    if kind == "read":
+                        # The reads of the post page: the post with its author, then its first comments.
+                        post_id = rng.randint(1, args.posts)
+                        crud_post.get_post_with_author(db=db, post_id=post_id)
+                        list(crud_comment.iter_post_comments(db=db, post_id=post_id,
+                                                             limit=app.config["COMMENTS_PER_PAGE"] + 1))
+                        db.session.rollback()
+                    else:
+                        text = f"<p>Load comment {number}-{len(latencies)}</p>"
+                        db.session.execute(insert(Comment), [{
+                            "post_id": rng.randint(1, args.posts),
+                            "author_id": rng.randint(1, args.users),
+                            "text": text,
+                            "text_hash": Comment.hash_text(text),
+                        }])
+                        db.session.commit()
+                except OperationalError:
+                    db.session.rollback()
+                    failed += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+            db.session.remove()
+        with lock:
+            results[kind] += latencies
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=("read", number)) for number in range(args.readers)]
+    threads += [threading.Thread(target=worker, args=("write", 1000 + number)) for number in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        db.engine.dispose()
+
+    return {
+        kind: {
+            "ops_per_second": round(len(samples) / args.seconds, 1),
+            "p50_ms": percentile(samples, 0.50),
+            "p99_ms": percentile(samples, 0.99),
+            "locked_errors": errors[kind],
+        }
+        for kind, samples in results.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--posts", type=int, default=10_000)
+    parser.add_argument("--comments", type=int, default=100_000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--presets", default="default,single-node,multi-worker")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = {preset: run_preset(directory, preset, args) for preset in args.presets.split(",")}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
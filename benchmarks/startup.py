@@ -0,0 +1,98 @@
+"""
+Measures how long a worker takes to start: importing the app package, running create_app and
+serving the first request.
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+
+Each run is a fresh interpreter, so the import cost is measured cold of the app but warm of the
+OS file cache, as for a worker forked or spawned next to others. The app is built on a temporary
+SQLite file, with DB_CREATE_ALL on and off, and the slowest modules of one run's -X importtime
+are listed. The JSON report is stable across runs so that two releases can be diffed.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.run import _git_revision
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import config
+from app import create_app
+imported = time.perf_counter()
+
+class StartupConfig(config.TestConfig):
+    SQLALCHEMY_DATABASE_URI = sys.argv[1]
+    DB_CREATE_ALL = sys.argv[2] == "true"
+    RAISE_ON_LAZY_LOAD = False
+
+app = create_app(StartupConfig)
+created = time.perf_counter()
+status = app.test_client().get("/about").status_code
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "create_app_ms": (created - imported) * 1000,
+                  "first_request_ms": (served - created) * 1000, "status": status}))
+"""
+
+
+def _probe(database_uri: str, create_all: bool, importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + [
+        "-c", _PROBE, database_uri, "true" if create_all else "false"
+    ]
+    return subprocess.run(command, capture_output=True, text=True, check=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _summarize(samples: list) -> dict:
+    return {
+        phase: {"median": round(statistics.median(sample[phase] for sample in samples), 2),
+                "min": round(min(sample[phase] for sample in samples), 2)}
+        for phase in ("import_ms", "create_app_ms", "first_request_ms")
+    }
+
+
+def _slowest_imports(stderr: str, count: int) -> list:
+    # Lines look like "import time:  self [us] | cumulative | imported package".
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        modules.append({"module": name, "self_ms": round(int(self_us) / 1000, 2),
+                        "cumulative_ms": round(int(cumulative_us) / 1000, 2)})
+    return sorted(modules, key=lambda module: module["self_ms"], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters started per mode.")
+    parser.add_argument("--top-imports", type=int, default=15, help="Number of slowest modules to report.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    report = {"revision": _git_revision(), "python": platform.python_version(), "runs": args.runs, "modes": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        database_uri = f"sqlite:///{os.path.join(directory, 'startup.sqlite3')}"
+        for create_all in (True, False):
+            samples = [json.loads(_probe(database_uri, create_all).stdout) for _ in range(args.runs)]
+            report["modes"][f"create_all_{'on' if create_all else 'off'}"] = _summarize(samples)
+            print(f"Measured {args.runs} starts with DB_CREATE_ALL={create_all}.", file=sys.stderr, flush=True)
+        report["slowest_imports"] = _slowest_imports(_probe(database_uri, False, importtime=True).stderr,
+                                                     args.top_imports)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
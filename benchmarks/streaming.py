@@ -0,0 +1,151 @@
+"""
+Compares rendered and streamed index and post pages: time to first byte, total time and the peak
+RSS of the worker.
+
+    python -m benchmarks.streaming --comments 20000 --body-kb 500 --output streaming.json
+
+Seeds a SQLite file with one post of --body-kb of HTML and --comments comments (plus a page of
+smaller posts for the index), then, for STREAM_TEMPLATES off and on, starts a fresh interpreter
+that serves the app from a threaded werkzeug server and fetches each page --requests times over
+HTTP. A fresh interpreter per mode keeps their peak RSS apart. The page cache is disabled so every
+request renders.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.run import _git_revision
+
+
+def _config(database_path: str, streaming: bool):
+    from config import TestConfig
+
+    class StreamingBenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.abspath(database_path)}"
+        RAISE_ON_LAZY_LOAD = False
+        STREAM_TEMPLATES = streaming
+
+    return StreamingBenchmarkConfig
+
+
+def seed(database_path: str, comments: int, body_kb: int):
+    from app import create_app
+    from app.database import db
+    from app.models import BlogPost, Comment, User
+    from app.services import rendering
+
+    app = create_app(_config(database_path, False))
+    with app.app_context():
+        db.create_all()
+        author = User(email="author@example.com", password="x", name="Author")
+        db.session.add(author)
+        paragraph = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 16 + "</p>"
+        body = paragraph * (body_kb * 1024 // len(paragraph) + 1)
+        for number in range(10):
+            post_body = body if number == 0 else paragraph
+            compiled = rendering.compile_post(post_body)
+            db.session.add(BlogPost(title=f"Post {number}", subtitle="Subtitle", date="January 01, 2024",
+                                    body=post_body, body_html=compiled.body_html, excerpt=compiled.excerpt,
+                                    img_url="http://example.com/image.png", author=author))
+        db.session.flush()
+        started = datetime(2024, 1, 1)
+        text = "<p>A comment of a reasonable length, with <b>some</b> markup in it.</p>"
+        db.session.execute(db.insert(Comment), [
+            {"text": f"{text} {number}", "text_html": f"{text} {number}", "author_id": author.id, "post_id": 1,
+             "text_hash": Comment.hash_text(f"{text} {number}"), "created_at": started + timedelta(seconds=number)}
+            for number in range(comments)
+        ])
+        db.session.commit()
+
+
+def _fetch(port: int, path: str) -> tuple:
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    started = time.perf_counter()
+    connection.request("GET", path)
+    response = connection.getresponse()
+    response.read(1)
+    first_byte = time.perf_counter()
+    size = 1 + len(response.read())
+    done = time.perf_counter()
+    connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"GET {path} returned {response.status}")
+    return (first_byte - started) * 1000, (done - started) * 1000, size
+
+
+def measure(database_path: str, streaming: bool, requests: int) -> dict:
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app(_config(database_path, streaming))
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # ru_maxrss is in kilobytes on Linux.
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pages = {}
+    for name, path in (("index", "/"), ("post_page", "/post/1")):
+        samples = [_fetch(server.server_port, path) for _ in range(requests)]
+        pages[name] = {
+            "ttfb_ms_p50": round(statistics.median(sample[0] for sample in samples), 2),
+            "total_ms_p50": round(statistics.median(sample[1] for sample in samples), 2),
+            "bytes": samples[0][2],
+        }
+    server.shutdown()
+    return {
+        "pages": pages,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comments", type=int, default=20_000, help="Comments on the measured post.")
+    parser.add_argument("--body-kb", type=int, default=500, help="Size of the measured post body.")
+    parser.add_argument("--requests", type=int, default=10, help="Requests per page and mode.")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument("--measure", choices=["render", "stream"], help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.db, args.measure == "stream", args.requests)))
+        return
+
+    report = {"revision": _git_revision(), "python": platform.python_version(), "comments": args.comments,
+              "body_kb": args.body_kb, "requests": args.requests, "modes": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "streaming.sqlite3")
+        seed(database_path, args.comments, args.body_kb)
+        for mode in ("render", "stream"):
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.streaming", "--measure", mode, "--db", database_path,
+                 "--requests", str(args.requests)],
+                capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            )
+            report["modes"][mode] = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"Measured {mode}.", file=sys.stderr, flush=True)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
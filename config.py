@@ -3,13 +3,147 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Engine presets picked by DB_PRESET; each DB_* / SQLITE_* variable overrides its preset value.
+# - "single-node": one process serving requests from threads. A larger pool, and SQLite in WAL mode
+#   so readers never wait for the comment writer.
+# - "multi-worker": several worker processes on one host (e.g. gunicorn -w 4). A small pool per
+#   process keeps the total under the server's connection limit, connections are recycled and
+#   pinged, and SQLite writers wait longer for the lock other processes hold.
+# - "default": the SQLAlchemy and SQLite defaults, nothing applied.
+# None leaves a setting at its driver default. SQLITE_* settings are PRAGMAs run on every new
+# connection; pool settings apply to server databases only.
+DATABASE_PRESETS = {
+    "single-node": {
+        "pool_size": 10, "max_overflow": 10, "pool_pre_ping": True, "pool_recycle": 3600,
+        "journal_mode": "WAL", "synchronous": "NORMAL", "mmap_size": 268435456, "cache_size": -65536,
+        "busy_timeout": 5000,
+    },
+    "multi-worker": {
+        "pool_size": 2, "max_overflow": 3, "pool_pre_ping": True, "pool_recycle": 1800,
+        "journal_mode": "WAL", "synchronous": "NORMAL", "mmap_size": 268435456, "cache_size": -16384,
+        "busy_timeout": 15000,
+    },
+    "default": {
+        "pool_size": None, "max_overflow": None, "pool_pre_ping": False, "pool_recycle": None,
+        "journal_mode": None, "synchronous": None, "mmap_size": None, "cache_size": None, "busy_timeout": None,
+    },
+}
+_database_preset = DATABASE_PRESETS[os.getenv("DB_PRESET", "single-node")]
+
+
+def _preset_setting(variable: str, key: str, cast=int):
+    value = os.getenv(variable)
+    return _database_preset[key] if value is None else cast(value)
+
 
 class Config:
     SECRET_KEY = os.getenv("APP_SECRET_KEY")
     SQLALCHEMY_DATABASE_URI = os.getenv('DB_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = _preset_setting("DB_POOL_SIZE", "pool_size")
+    DB_MAX_OVERFLOW = _preset_setting("DB_MAX_OVERFLOW", "max_overflow")
+    DB_POOL_PRE_PING = _preset_setting("DB_POOL_PRE_PING", "pool_pre_ping", lambda value: value.lower() == "true")
+    DB_POOL_RECYCLE = _preset_setting("DB_POOL_RECYCLE", "pool_recycle")
+    SQLITE_JOURNAL_MODE = _preset_setting("SQLITE_JOURNAL_MODE", "journal_mode", str)
+    SQLITE_SYNCHRONOUS = _preset_setting("SQLITE_SYNCHRONOUS", "synchronous", str)
+    SQLITE_MMAP_SIZE = _preset_setting("SQLITE_MMAP_SIZE", "mmap_size")
+    SQLITE_CACHE_SIZE = _preset_setting("SQLITE_CACHE_SIZE", "cache_size")
+    SQLITE_BUSY_TIMEOUT = _preset_setting("SQLITE_BUSY_TIMEOUT", "busy_timeout")
+    # Read replicas, as a comma separated DB_REPLICA_URLS. The crud get_* functions read from them
+    # round-robin, skipping replicas that fail a health check; a visitor who just wrote reads from
+    # the primary for DB_REPLICA_STICKY_SECONDS.
+    SQLALCHEMY_BINDS = {
+        f"replica_{number}": url
+        for number, url in enumerate(filter(None, os.getenv("DB_REPLICA_URLS", "").split(",")), start=1)
+    }
+    DB_REPLICA_BINDS = list(SQLALCHEMY_BINDS)
+    DB_REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_CHECK_INTERVAL", 5))
+    DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", 5))
+    # Creates missing tables on every app start. Deployments set it to false and manage the schema
+    # as a separate step with flask db init (new databases) and flask db upgrade.
+    DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "true").lower() == "true"
+    POSTS_PER_PAGE = int(os.getenv("POSTS_PER_PAGE", 10))
+    # The most posts a request to /api/v1/posts can return, by limit or by ids.
+    API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 100))
+    # Comments rendered with a post, and per page of /post/<id>/comments, which loads the rest.
+    COMMENTS_PER_PAGE = int(os.getenv("COMMENTS_PER_PAGE", 50))
+    # Length in characters of the plain-text excerpt of each post shown on the index.
+    POST_EXCERPT_LENGTH = int(os.getenv("POST_EXCERPT_LENGTH", 280))
+    RAISE_ON_LAZY_LOAD = False
+    # Streams the index and post pages while they render, the post page reading its first page of
+    # comments STREAM_COMMENTS_BATCH_SIZE at a time, instead of building the whole page first.
+    # Responses go out in chunks of at least STREAM_BUFFER_SIZE characters.
+    STREAM_TEMPLATES = os.getenv("STREAM_TEMPLATES", "false").lower() == "true"
+    STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", 8192))
+    STREAM_COMMENTS_BATCH_SIZE = int(os.getenv("STREAM_COMMENTS_BATCH_SIZE", 100))
+    # Post views are counted in memory and written to post_stats in one batched UPDATE every
+    # VIEW_COUNTER_FLUSH_INTERVAL seconds or VIEW_COUNTER_FLUSH_THRESHOLD views, and at exit.
+    VIEW_COUNTER_ENABLED = os.getenv("VIEW_COUNTER_ENABLED", "true").lower() == "true"
+    VIEW_COUNTER_FLUSH_INTERVAL = float(os.getenv("VIEW_COUNTER_FLUSH_INTERVAL", 5))
+    VIEW_COUNTER_FLUSH_THRESHOLD = int(os.getenv("VIEW_COUNTER_FLUSH_THRESHOLD", 1000))
+    # A post and its comments are deleted POST_DELETE_BATCH_SIZE comments per transaction, by a
+    # background thread when it has at least POST_DELETE_BACKGROUND_THRESHOLD comments (0 never).
+    POST_DELETE_BATCH_SIZE = int(os.getenv("POST_DELETE_BATCH_SIZE", 1000))
+    POST_DELETE_BACKGROUND_THRESHOLD = int(os.getenv("POST_DELETE_BACKGROUND_THRESHOLD", 10000))
+    # Rendered-page cache for anonymous visitors. The "memory" backend is per process, the "sqlite"
+    # backend keeps entries in PAGE_CACHE_PATH and is shared by all workers on the host.
+    PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true"
+    PAGE_CACHE_BACKEND = os.getenv("PAGE_CACHE_BACKEND", "memory")
+    PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", "page_cache.sqlite3")
+    PAGE_CACHE_MAX_ENTRIES = int(os.getenv("PAGE_CACHE_MAX_ENTRIES", 1024))
+    PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", 300))
+    # The RSS feed and the sitemap are generated into SYNDICATION_DIR, shared by all workers on the
+    # host, and served from there until a post changes. Past SITEMAP_SHARD_SIZE posts (at most
+    # 50000), the sitemap is split into shards. Their links start with SYNDICATION_BASE_URL, e.g.
+    # https://blog.example.com, or with SERVER_NAME when it is not set.
+    SYNDICATION_DIR = os.getenv("SYNDICATION_DIR", "syndication")
+    SYNDICATION_BASE_URL = os.getenv("SYNDICATION_BASE_URL", "")
+    SYNDICATION_TITLE = os.getenv("SYNDICATION_TITLE", "Wise Engineer's Blog")
+    SYNDICATION_DESCRIPTION = os.getenv("SYNDICATION_DESCRIPTION", "A collection of my notes.")
+    SYNDICATION_FEED_SIZE = int(os.getenv("SYNDICATION_FEED_SIZE", 20))
+    SITEMAP_SHARD_SIZE = int(os.getenv("SITEMAP_SHARD_SIZE", 10000))
+    # flask assets build writes fingerprinted, precompressed copies of the static files into this
+    # folder of app/static; once built, they are linked instead and cached for ASSETS_MAX_AGE seconds.
+    ASSETS_BUILD_DIR = os.getenv("ASSETS_BUILD_DIR", "dist")
+    ASSETS_MAX_AGE = int(os.getenv("ASSETS_MAX_AGE", 31536000))
+    # "fts5" (SQLite only), "inverted" (any database) or "auto" to pick from DB_URL.
+    SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "auto")
+    # Password hashing runs in a pool of PASSWORD_HASH_WORKERS processes (0 hashes inline in the
+    # request worker). Requests beyond workers + PASSWORD_HASH_QUEUE_LIMIT get a 503 at once.
+    # Hashes made with other parameters are upgraded at the next successful login.
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    PASSWORD_SALT_LENGTH = int(os.getenv("PASSWORD_SALT_LENGTH", 16))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(os.cpu_count() or 1, 4)))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 16))
+    PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+    # Per-process cache of logged in users, so authenticated requests skip the users table.
+    IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", 10000))
+    IDENTITY_CACHE_TTL = int(os.getenv("IDENTITY_CACHE_TTL", 60))
+    # Logs are written by a background thread. LOG_FORMAT is "json" or "text". LOG_SAMPLING keeps
+    # that fraction of the INFO records of a logger and its children, e.g. {"app.database": 0.1}.
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_SAMPLING = {"app.database.crud_post.reads": 0.1, "app.database.crud_comment.reads": 0.1}
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    # Per-route request, SQL and template metrics of each worker, exported at /metrics.
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # /metrics answers requests from METRICS_ALLOWED_IPS (comma separated) or with the header
+    # "Authorization: Bearer <METRICS_TOKEN>", and nobody else.
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+                           if ip.strip()]
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
 
 
 class TestConfig(Config):
     TESTING = True
+    SECRET_KEY = "test-secret-key"
+    WTF_CSRF_ENABLED = False
+    RAISE_ON_LAZY_LOAD = True
+    PAGE_CACHE_ENABLED = False
+    VIEW_COUNTER_ENABLED = False
+    PASSWORD_HASH_WORKERS = 0
+    LOG_LEVEL = "WARNING"
+    SYNDICATION_BASE_URL = "http://localhost"
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # The test cases create and drop the tables themselves.
+    DB_CREATE_ALL = False